@@ -0,0 +1,105 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+"""time redrawing the wavelength calibration plot and check the residuals are drawn
+
+The plot is rendered offscreen for a synthetic light source. The full redraw
+after a refit and the blitted update of the residuals are timed. The script
+fails if the residual markers are not visible in the rendered image. Use the
+--max-time option to turn the benchmark into a regression check.
+"""
+
+import argparse
+import os
+import sys
+import time
+import numpy
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5 import QtWidgets
+from piccolo3.utils.CalibratePlot import CalibratePlot
+from piccolo3.utils.peakTable import PeakTable
+
+class SyntheticData(object):
+    """the parts of CalibrateData used by CalibratePlot"""
+
+    def __init__(self, numSpectra, numLines, rng, numPixels=1024):
+        pixels = numpy.arange(numPixels)
+        self.origWavelengthGrid = 350.+0.7*pixels
+        self.newWavelengthGrid = self.origWavelengthGrid+0.5
+        peaks = numpy.sort(rng.choice(numpy.arange(10,numPixels-10), numLines, replace=False))
+        self.spectralLines = {'lamp' : argparse.Namespace(wavelengths=self.newWavelengthGrid[peaks])}
+        self.spectrumLightSource = numpy.array(['lamp']*numSpectra)
+        self.intensity = numpy.zeros((numSpectra, numPixels))
+        self.peakTable = PeakTable()
+        for i in range(numSpectra):
+            self.intensity[i,peaks] = rng.uniform(1000, 50000, numLines)
+            self.peakTable.add(i, 'lamp', peaks)
+        idx = self.peakTable.select('lamp')
+        self.peakTable.setWavelength(idx, self.newWavelength(self.peakTable.position[idx])+rng.normal(0, 0.1, len(idx)))
+
+    def newWavelength(self, positions):
+        return 350.5+0.7*numpy.asarray(positions)
+
+def residualPixels(plot):
+    """the number of pixels in the colour of the residual markers"""
+    rgba = numpy.asarray(plot.buffer_rgba())
+    return int(numpy.sum((rgba[...,2] > 200) & (rgba[...,0] < 60) & (rgba[...,1] < 60)))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('-s','--spectra',type=int,default=24,help='number of spectra, default: 24')
+    parser.add_argument('-l','--lines',type=int,default=30,help='number of spectral lines, default: 30')
+    parser.add_argument('-r','--repeat',type=int,default=5,help='number of repetitions, default: 5')
+    parser.add_argument('-m','--max-time',type=float,help='fail if the best redraw or blit time in seconds exceeds this value')
+    args = parser.parse_args()
+
+    app = QtWidgets.QApplication([])
+    plot = CalibratePlot()
+    plot.resize(1200, 800)
+    plot.data = SyntheticData(args.spectra, args.lines, numpy.random.default_rng(42))
+
+    redraw = []
+    for i in range(args.repeat):
+        t0 = time.perf_counter()
+        # plotData schedules a single draw which runs when the events are processed
+        plot.plotData('lamp')
+        app.processEvents()
+        redraw.append(time.perf_counter()-t0)
+    drawn = residualPixels(plot)
+
+    blit = []
+    for i in range(args.repeat):
+        t0 = time.perf_counter()
+        plot.updateResiduals()
+        app.processEvents()
+        blit.append(time.perf_counter()-t0)
+    blitted = residualPixels(plot)
+
+    print('{:10s} {:>10s} {:>10s}'.format('update','time [s]','pixels'))
+    print('{:10s} {:10.4f} {:10d}'.format('redraw', min(redraw), drawn))
+    print('{:10s} {:10.4f} {:10d}'.format('blit', min(blit), blitted))
+    if drawn == 0 or blitted == 0:
+        print('the residuals are not drawn')
+        sys.exit(1)
+    if args.max_time is not None and max(min(redraw), min(blit)) > args.max_time:
+        print('update time exceeded {} seconds'.format(args.max_time))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
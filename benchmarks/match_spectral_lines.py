@@ -0,0 +1,63 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+"""benchmark matching peaks against dense catalogues of spectral lines"""
+
+import argparse
+import tempfile
+import time
+import os
+import numpy
+from piccolo3.utils.matchSpectralLines import PiccoloSpectralLines
+
+def catalogue(numLines, rng, wmin=300., wmax=1100.):
+    """write a random line catalogue and return its file name"""
+    lines = numpy.sort(rng.uniform(wmin, wmax, numLines))
+    fd, fname = tempfile.mkstemp(suffix='.csv')
+    with os.fdopen(fd, 'w') as out:
+        numpy.savetxt(out, lines)
+    return fname, lines
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-l','--lines',type=int,nargs='+',default=[100,1000,5000,20000,100000],help='number of lines in the catalogues, default: 100 1000 5000 20000 100000')
+    parser.add_argument('-p','--peaks',type=int,default=500,help='number of peaks, default: 500')
+    parser.add_argument('-m','--max-dist',type=float,default=2.,help='maximum distance between peak and line, default: 2')
+    parser.add_argument('-r','--repeat',type=int,default=5,help='number of repetitions, default: 5')
+    args = parser.parse_args()
+
+    rng = numpy.random.default_rng(42)
+    print('{:>8s} {:>8s} {:>8s} {:>10s}'.format('lines','peaks','matched','time [s]'))
+    for n in args.lines:
+        fname, lines = catalogue(n, rng)
+        try:
+            spectralLines = PiccoloSpectralLines(fname)
+        finally:
+            os.unlink(fname)
+        # peaks near a random subset of lines plus some noise
+        w = rng.choice(lines, size=min(args.peaks, n), replace=False) + rng.normal(0, 0.3*args.max_dist, min(args.peaks, n))
+        peaks = list(zip(range(len(w)), w))
+
+        timings = []
+        for i in range(args.repeat):
+            t0 = time.perf_counter()
+            matched = spectralLines.match(peaks, maxDist=args.max_dist)
+            timings.append(time.perf_counter()-t0)
+        print('{:8d} {:8d} {:8d} {:10.4f}'.format(n, len(peaks), len(matched), min(timings)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+"""measure the startup time of the piccolo3 command line tools
+
+Each console script module is imported in a fresh interpreter a number of
+times and the best and median wall clock times are reported. Use the
+--max-time option to turn the benchmark into a regression check.
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+import statistics
+
+SCRIPTS = {
+    'piccolo3-read' : 'piccolo3.readpicco',
+    'piccolo3-calibrate' : 'piccolo3.radiometric_cal',
+    'piccolo3-apply-calibration' : 'piccolo3.apply_calibration',
+    'piccolo3-reflectance' : 'piccolo3.reflectance',
+    'piccolo3-resample' : 'piccolo3.resample',
+    'piccolo3-aggregate' : 'piccolo3.aggregate',
+    'piccolo3-wavelengthCalibration' : 'piccolo3.pcalibrate',
+    'piccolo3-display' : 'piccolo3.disppicco',
+    'piccolo3-display-dark' : 'piccolo3.dispdark',
+    'piccolo3-quicklook' : 'piccolo3.quicklook',
+    'piccolo3-dark-trend' : 'piccolo3.dark_trend',
+    'piccolo3-discard-saturated' : 'piccolo3.discard_saturated',
+}
+
+def startup_time(module, repeat=5):
+    """import module in a new interpreter repeat times and return the timings"""
+    cmd = [sys.executable, '-c', 'import {}'.format(module)]
+    timings = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run(cmd, check=True)
+        timings.append(time.perf_counter()-t0)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('script',nargs='*',help='the scripts to check, default: all')
+    parser.add_argument('-r','--repeat',type=int,default=5,help='number of repetitions, default: 5')
+    parser.add_argument('-m','--max-time',type=float,help='fail if the median startup time in seconds of any script exceeds this value')
+    args = parser.parse_args()
+
+    # baseline: the bare interpreter
+    base = statistics.median(startup_time('sys', repeat=args.repeat))
+    print('{:35s} {:>8s} {:>8s}'.format('script','best','median'))
+    print('{:35s} {:8.3f} {:8.3f}'.format('python', base, base))
+
+    scripts = args.script if len(args.script) > 0 else list(SCRIPTS.keys())
+    failed = []
+    for s in scripts:
+        if s not in SCRIPTS:
+            parser.error('unknown script {}'.format(s))
+        t = startup_time(SCRIPTS[s], repeat=args.repeat)
+        m = statistics.median(t)
+        print('{:35s} {:8.3f} {:8.3f}'.format(s, min(t), m))
+        if args.max_time is not None and m > args.max_time:
+            failed.append(s)
+
+    if len(failed) > 0:
+        print('startup time exceeded {} seconds: {}'.format(args.max_time, ', '.join(failed)))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# Copyright 2014-2016 The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+from piccolo3.common import piccoloLogging
+from piccolo3.utils import aggregate_spectra
+import logging
+from pathlib import Path
+import xarray
+
+def main():
+    from piccolo3.utils.aggregate import PERCENTILES
+    parser = argparse.ArgumentParser()
+    parser.add_argument('data',metavar='DATA',nargs='+',help='input files produced by piccolo3-read, piccolo3-apply-calibration, piccolo3-reflectance or piccolo3-resample')
+    parser.add_argument('-p','--prefix',default='.',help='the name of the output directory')
+    parser.add_argument('-f','--frequency',help='aggregate spectra in time bins of this length, eg 1min, 10min or 1D')
+    parser.add_argument('-b','--by-batch',action='store_true',default=False,help='aggregate spectra by run and batch')
+    parser.add_argument('-q','--percentile',type=float,action='append',help='compute this percentile, can be repeated, default: %s'%', '.join(str(q) for q in PERCENTILES))
+    parser.add_argument('--no-percentiles',action='store_true',default=False,help='only compute mean, standard deviation and count')
+    parser.add_argument('--reservoir-size',type=int,default=10000,help='maximum number of spectra per bin used for the percentiles, default: 10000')
+    parser.add_argument('--chunk-size',type=int,default=1000,help='number of spectra processed at a time, default: 1000')
+    parser.add_argument('-d','--debug',action='store_true',default=False,help='enable debug')
+    args = parser.parse_args()
+
+    # start logging
+    piccoloLogging(debug=args.debug)
+    log = logging.getLogger("piccolo.aggregate")
+
+    out = Path(args.prefix)
+    if not out.exists():
+        parser.error(f'output directory {out} does not exist')
+    if not out.is_dir():
+        parser.error(f'output directory {out} is not a directory')
+    if args.frequency is None and not args.by_batch:
+        parser.error('select time bins with --frequency and/or --by-batch')
+    if args.no_percentiles:
+        percentiles = []
+    elif args.percentile is not None:
+        percentiles = args.percentile
+    else:
+        percentiles = PERCENTILES
+
+    label = '_'.join(([args.frequency] if args.frequency is not None else []) + (['batch'] if args.by_batch else []))
+    for f in args.data:
+        outname = out.joinpath('%s_%s.nc'%(Path(f).stem,label))
+        log.info('aggregating %s, writing %s'%(f,outname))
+        with xarray.open_dataset(f) as ds:
+            n = aggregate_spectra(ds, outname, freq=args.frequency, byBatch=args.by_batch, percentiles=percentiles,
+                                  chunkSize=args.chunk_size, reservoirSize=args.reservoir_size)
+        log.info('wrote %d aggregated spectra'%n)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# Copyright 2014-2016 The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+from piccolo3.common import piccoloLogging
+from piccolo3.utils import read_calibrations, apply_radiometric_calibration
+import logging
+from pathlib import Path
+import xarray
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dn',metavar='DN',nargs='+',help='input dn files produced by piccolo3-read')
+    parser.add_argument('-c','--calibration-files',default=[],nargs='+',required=True,help='radiometric calibration files, you can use this option multiple time and/or use wildcards')
+    parser.add_argument('-p','--prefix',default='.',help='the name of the output directory')
+    parser.add_argument('--chunk-size',type=int,default=1000,help='number of spectra processed at a time, default: 1000')
+    parser.add_argument('-d','--debug',action='store_true',default=False,help='enable debug')
+    args = parser.parse_args()
+
+    # start logging
+    piccoloLogging(debug=args.debug)
+    log = logging.getLogger("piccolo.apply_calibration")
+
+    out = Path(args.prefix)
+    if not out.exists():
+        parser.error(f'output directory {out} does not exist')
+    if not out.is_dir():
+        parser.error(f'output directory {out} is not a directory')
+
+    calibrations = read_calibrations(args.calibration_files)
+
+    for f in args.dn:
+        with xarray.open_dataset(f) as dn:
+            s = dn.attrs['serial']
+            c = dn.attrs['direction']
+            try:
+                cal = calibrations[s][c]
+            except KeyError:
+                log.error('no calibration for %s %s in file %s'%(s,c,f))
+                continue
+            outname = out.joinpath('%s_%s.nc'%(s,c))
+            if outname.resolve() == Path(f).resolve():
+                log.error('refusing to overwrite input file %s'%f)
+                continue
+            log.info('calibrating %s, writing %s'%(f,outname))
+            apply_radiometric_calibration(dn, cal, outname, chunkSize=args.chunk_size)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# Copyright 2014-2016 The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+"""fit the dark counts of each pixel against detector temperature, integration time and time"""
+
+import argparse
+from piccolo3.common import piccoloLogging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import logging
+import os
+
+def _process(files, terms):
+    from piccolo3.utils import DarkTrend
+    log = logging.getLogger("piccolo.dark_trend")
+    trend = DarkTrend(terms=terms)
+    for f in files:
+        log.debug('reading file %s'%f)
+        try:
+            trend.addFile(f)
+        except Exception as e:
+            log.error('cannot read file %s: %s'%(f,e))
+    return trend
+
+def dark_trend(piccoFiles, terms, jobs=None):
+    """accumulate the dark trend of all instruments from a list of piccolo files
+
+    The files are split into chunks that are processed in parallel and the
+    normal equations of the chunks are merged.
+
+    Returns
+    -------
+    a DarkTrend object
+    """
+    from piccolo3.utils import DarkTrend
+    trend = DarkTrend(terms=terms)
+    nChunks = min(len(piccoFiles), 4*(jobs or os.cpu_count() or 1))
+    if nChunks == 0:
+        return trend
+    chunks = [piccoFiles[i::nChunks] for i in range(nChunks)]
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        for t in executor.map(_process, chunks, [terms]*nChunks):
+            trend.merge(t)
+    return trend
+
+def main():
+    from piccolo3.utils.darkTrend import DARK_TREND_TERMS
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('picco',metavar='PICCO',nargs='+',help='input piccolo json files or directories containing them')
+    parser.add_argument('-o','--output',default='.',help='the name of the output directory, default: current directory')
+    parser.add_argument('-t','--term',action='append',choices=DARK_TREND_TERMS,help='explanatory variable, can be repeated, default: all')
+    parser.add_argument('-j','--jobs',type=int,help='number of parallel processes, default: number of CPUs')
+    parser.add_argument('-d','--debug',action='store_true',default=False,help='enable debug')
+    args = parser.parse_args()
+
+    # start logging
+    piccoloLogging(debug=args.debug)
+    log = logging.getLogger("piccolo.dark_trend")
+
+    out = Path(args.output)
+    if not out.is_dir():
+        parser.error(f'output directory {out} does not exist')
+    terms = args.term if args.term is not None else DARK_TREND_TERMS
+
+    files = []
+    for p in args.picco:
+        p = Path(p)
+        if p.is_dir():
+            files += [str(f) for f in sorted(p.rglob('*.pico'))]
+        else:
+            files.append(str(p))
+
+    trend = dark_trend(files, terms, jobs=args.jobs)
+    if trend.skipped > 0:
+        log.warning('skipped %d dark spectra without detector temperature'%trend.skipped)
+
+    print('{:15s} {:12s} {:>10s} {:>15s} {:>15s}'.format('serial','direction','spectra','drift/day','cadence/days'))
+    for key in trend.instruments:
+        result = trend.fit(*key)
+        outname = out.joinpath('%s_%s_dark_trend.nc'%key)
+        log.info('writing %s'%outname)
+        result.to_netcdf(outname)
+        print('{:15s} {:12s} {:10d} {:15.4g} {:15.4g}'.format(key[0], key[1], result.attrs['number_of_spectra'],
+                                                               result.attrs.get('median_drift',float('nan')),
+                                                               result.attrs.get('median_cadence',float('nan'))))
+
+if __name__ == '__main__':
+    main()
@@ -18,25 +18,27 @@
 import argparse
 from piccolo3.common import piccoloLogging, PiccoloSpectrum, PiccoloSpectraList
 import logging
-from matplotlib import pyplot
 import numpy
+from pathlib import Path
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('picco',metavar='PICCO',nargs='+',help='input piccolo json files')
-    parser.add_argument('-d','--debug',action='store_true',default=False,help='enable debug')
+def plotDarkPixels(ax, piccoFiles):
+    """plot the dark pixels normalised by integration time
 
-    args = parser.parse_args()
+    For a single file the normalised value of each dark pixel is plotted,
+    for several files the mean and standard deviation of each spectrum.
 
-    # start logging
-    piccoloLogging(debug=args.debug)
+    Parameters
+    ----------
+    ax - the matplotlib axes to plot into
+    piccoFiles - the names of the piccolo files
+    """
     log = logging.getLogger("piccolo.display")
 
-    if len(args.picco) > 1:
+    if len(piccoFiles) > 1:
     
         data = {}
 
-        for f in args.picco:
+        for f in piccoFiles:
             log.debug('reading file %s'%f)
 
             spectra = PiccoloSpectraList(data=open(f,'r').read())
@@ -52,18 +54,80 @@ def main():
 
         for s in data:
             x = numpy.arange(len(data[s]['mean']))
-            pyplot.errorbar(x,data[s]['mean'],yerr=data[s]['std'],fmt='o',label=s)
+            ax.errorbar(x,data[s]['mean'],yerr=data[s]['std'],fmt='o',label=s)
     else:
-        spectra = PiccoloSpectraList(data=open(args.picco[0],'r').read())
+        spectra = PiccoloSpectraList(data=open(piccoFiles[0],'r').read())
 
         for s in spectra:
             normalised_dark = s.dark_pixels/s['IntegrationTime']
-            p=pyplot.plot(normalised_dark,'o',label='{} {}'.format(s['SerialNumber'],s['Direction']))
-            pyplot.axhline(normalised_dark.mean(),color=p[0].get_color())
+            p=ax.plot(normalised_dark,'o',label='{} {}'.format(s['SerialNumber'],s['Direction']))
+            ax.axhline(normalised_dark.mean(),color=p[0].get_color())
         
 
-    pyplot.legend(bbox_to_anchor=(0., 1.02, 1., .102), loc='lower left',
-                  ncol=2, mode="expand", borderaxespad=0.)
+    ax.legend(bbox_to_anchor=(0., 1.02, 1., .102), loc='lower left',
+              ncol=2, mode="expand", borderaxespad=0.)
+
+def darkStatistics(piccoFiles, outdir, hotThreshold=5., deadThreshold=0.01):
+    """update the per pixel dark statistics stored in directory outdir
+
+    The statistics already stored in outdir are loaded and only the dark
+    spectra of files that were not processed before are added.
+
+    Parameters
+    ----------
+    piccoFiles - the names of the piccolo files or of directories containing them
+    outdir - the directory containing the statistics
+    hotThreshold - threshold used for detecting hot pixels
+    deadThreshold - threshold used for detecting dead pixels
+
+    Returns
+    -------
+    the DarkStatistics object
+    """
+    from piccolo3.utils import DarkStatistics
+    log = logging.getLogger("piccolo.dark")
+
+    stats = DarkStatistics(hotThreshold=hotThreshold, deadThreshold=deadThreshold)
+    for key in stats.loadDirectory(outdir):
+        log.info('loaded statistics of %s %s from %d files'%(key+(len(stats.files(*key)),)))
+
+    for p in piccoFiles:
+        p = Path(p)
+        if p.is_dir():
+            files = sorted(p.rglob('*.pico'))
+        else:
+            files = [p]
+        for f in files:
+            log.debug('reading file %s'%f)
+            stats.addFile(f)
+
+    stats.write(outdir)
+    for key in stats.instruments:
+        hot,dead = stats.mask(*key)
+        log.info('%s %s: %d spectra, %d hot pixels, %d dead pixels'%(key+(stats.statistics(*key).numSpectra,hot.sum(),dead.sum())))
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('picco',metavar='PICCO',nargs='+',help='input piccolo json files')
+    parser.add_argument('-d','--debug',action='store_true',default=False,help='enable debug')
+    parser.add_argument('-o','--output',metavar='DIR',help='accumulate the per pixel statistics of the dark spectra and store them together with a hot/dead pixel mask in directory DIR instead of plotting, existing statistics are updated with new files, PICCO can also be a directory')
+    parser.add_argument('--hot-threshold',type=float,default=5.,help='pixels exceeding the median dark by more than HOT_THRESHOLD robust standard deviations are hot, default: 5')
+    parser.add_argument('--dead-threshold',type=float,default=0.01,help='pixels whose standard deviation is less than DEAD_THRESHOLD times the median standard deviation are dead, default: 0.01')
+
+    args = parser.parse_args()
+
+    # start logging
+    piccoloLogging(debug=args.debug)
+
+    if args.output is not None:
+        if not Path(args.output).is_dir():
+            parser.error('output directory %s does not exist'%args.output)
+        darkStatistics(args.picco, args.output, hotThreshold=args.hot_threshold, deadThreshold=args.dead_threshold)
+        return
+
+    from matplotlib import pyplot
+    plotDarkPixels(pyplot.gca(), args.picco)
     pyplot.show()
         
 if __name__ == '__main__':
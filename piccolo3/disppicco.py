@@ -17,53 +17,58 @@
 
 import argparse
 from piccolo3.common import piccoloLogging, PiccoloSpectrum, PiccoloSpectraList
+from piccolo3.utils.spectraPlot import plot_spectra, DECIMATE_METHODS
 import logging
-from matplotlib import pyplot
+import numpy
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('picco',metavar='PICCO',nargs='+',help='input piccolo json files')
-    parser.add_argument('-d','--debug',action='store_true',default=False,help='enable debug')
-    parser.add_argument('--direction',action='append',help='select directions to plot')
-    parser.add_argument('--dark',action='store_true',default=False,help='show dark spectra')
-    parser.add_argument('--use-original-wavelength-coefficients',action='store_true',default=False,help='use original wavelength coefficients insteat of piccolo coefficients')
-    args = parser.parse_args()
-
-    # start logging
-    piccoloLogging(debug=args.debug)
-    log = logging.getLogger("piccolo.display")
-
-    use_piccolo_coeff = not args.use_original_wavelength_coefficients
-    
-    if args.direction is None:
-        directions = ['upwelling','downwelling']
-    else:
-        directions = args.direction
+colours = ['red','green','blue','orange','pink']
 
-    if args.dark:
-        spectrum = 'Dark'
-    else:
-        spectrum = 'Light'
+def setupAxes(fig, directions):
+    """create one axes per direction in figure fig
 
+    Returns
+    -------
+    dictionary of axes indexed by direction
+    """
+    a = fig.subplots(1,len(directions),sharex=True,sharey=True,squeeze=False)[0]
     axes = {}
-    fig, a = pyplot.subplots(1,len(directions),sharex=True,sharey=True)
-    if len(directions) == 1:
-        a = [a]
     for i in range(len(directions)):
-        a[i].set_title(directions[i])
-        a[i].set_xlabel('wavelength')
+        axes[directions[i]] = a[i]
+    labelAxes(axes, directions)
+    return axes
+
+def labelAxes(axes, directions):
+    """set the titles and labels of the axes"""
+    for i in range(len(directions)):
+        a = axes[directions[i]]
+        a.set_title(directions[i])
+        a.set_xlabel('wavelength')
         if i == 0:
-            a[i].set_ylabel('intensity')
+            a.set_ylabel('intensity')
         else:
-            a[i].get_yaxis().set_visible(False)
-        
-        axes[directions[i]] = a[i]
-            
+            a.get_yaxis().set_visible(False)
+
+def collectSpectra(piccoFiles, directions, spectrum='Light', piccolo=True):
+    """read the spectra contained in a list of piccolo files
+
+    Parameters
+    ----------
+    piccoFiles - the names of the piccolo files
+    directions - the directions to read
+    spectrum - the spectrum type, Light or Dark
+    piccolo - use the piccolo wavelength coefficients
+
+    Returns
+    -------
+    dictionary mapping the serial numbers to colour and saturation level and
+    dictionary mapping (direction, serial number, saturated) to the lists of
+    wavelengths and intensities of the spectra
+    """
+    log = logging.getLogger("piccolo.display")
 
-    colours = ['red','green','blue','orange','pink']
     instruments = {}
-        
-    for f in args.picco:
+    collected = {}
+    for f in piccoFiles:
         log.info('reading file %s'%f)
 
         spectra = PiccoloSpectraList(data=open(f,'r').read())
@@ -73,30 +78,103 @@ def main():
             continue
         for d in directions:
             for s in spectra.getSpectra(d,spectrum):
-                
                 if s['SerialNumber'] not in instruments:
                     c = colours[len(instruments)]
                     instruments[s['SerialNumber']] = (c,s['SaturationLevel'])
-                w,p = s.getData(piccolo=use_piccolo_coeff)
-                if (s.isSaturated):
-                    style = '--'
-                else:
-                    style = '-'
-                axes[d].plot(w,p,ls=style,color=instruments[s['SerialNumber']][0])
+                w,p = s.getData(piccolo=piccolo)
+                key = (d,s['SerialNumber'],s.isSaturated)
+                if key not in collected:
+                    collected[key] = ([],[])
+                collected[key][0].append(w)
+                collected[key][1].append(p)
+    return instruments, collected
 
+def drawSpectra(axes, instruments, collected, maxLines=1000, decimate='envelope'):
+    """draw the spectra collected by collectSpectra, saturated spectra are dashed"""
+    log = logging.getLogger("piccolo.display")
+
+    for (d,sn,saturated),(w,p) in collected.items():
+        style = '--' if saturated else '-'
+        if len(set(len(x) for x in p)) > 1:
+            # the number of pixels changed, plot the spectra individually
+            for i in range(len(p)):
+                plot_spectra(axes[d],w[i],p[i],instruments[sn][0],linestyle=style)
+            continue
+        w = numpy.array(w)
+        p = numpy.array(p)
+        log.debug('plotting %d spectra of %s %s'%(len(p),sn,d))
+        plot_spectra(axes[d],w,p,instruments[sn][0],linestyle=style,
+                     maxLines=maxLines,decimate=decimate)
+
+def addLegend(fig, axes, instruments):
+    """draw the saturation level of each instrument and add a legend of the instruments"""
     handles = []
     labels = []
-    haveLabels = False
-    for d in directions:
+    for i,d in enumerate(axes):
         for s in instruments:
             h = axes[d].axhline(instruments[s][1],color=instruments[s][0])
-            if not haveLabels:
+            if i == 0:
                 handles.append(h)
                 labels.append(s)
-        haveLabels = True
+
+    fig.legend(handles=handles,loc="lower center",labels=labels,ncol=max(len(instruments),1))
+    fig.subplots_adjust(bottom=0.18)
+
+def plotSpectra(fig, axes, piccoFiles, spectrum='Light', piccolo=True, maxLines=1000, decimate='envelope'):
+    """plot the spectra contained in a list of piccolo files
+
+    Parameters
+    ----------
+    fig - the matplotlib figure
+    axes - dictionary of axes indexed by direction
+    piccoFiles - the names of the piccolo files
+    spectrum - the spectrum type, Light or Dark
+    piccolo - use the piccolo wavelength coefficients
+    maxLines - the maximum number of spectra per instrument and direction drawn individually
+    decimate - the decimation method used for more spectra
+
+    Returns
+    -------
+    dictionary mapping the serial numbers to colour and saturation level
+    """
+    # the spectra are collected by direction, instrument and saturation
+    # and drawn in one go
+    instruments, collected = collectSpectra(piccoFiles, list(axes), spectrum=spectrum, piccolo=piccolo)
+    drawSpectra(axes, instruments, collected, maxLines=maxLines, decimate=decimate)
+    addLegend(fig, axes, instruments)
+    return instruments
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('picco',metavar='PICCO',nargs='+',help='input piccolo json files')
+    parser.add_argument('-d','--debug',action='store_true',default=False,help='enable debug')
+    parser.add_argument('--direction',action='append',help='select directions to plot')
+    parser.add_argument('--dark',action='store_true',default=False,help='show dark spectra')
+    parser.add_argument('-m','--max-lines',type=int,default=1000,help='maximum number of spectra per instrument and direction drawn individually, default: 1000')
+    parser.add_argument('--decimate',choices=DECIMATE_METHODS,default='envelope',help='how to draw more than MAX_LINES spectra, envelope: the minimum and maximum of each pixel, density: an image of the density of the spectra, default: envelope')
+    parser.add_argument('--use-original-wavelength-coefficients',action='store_true',default=False,help='use original wavelength coefficients insteat of piccolo coefficients')
+    args = parser.parse_args()
+
+    # start logging
+    piccoloLogging(debug=args.debug)
+
+    use_piccolo_coeff = not args.use_original_wavelength_coefficients
     
-    fig.legend(handles=handles,loc="lower center",labels=labels,ncol=len(instruments))
-    pyplot.subplots_adjust(bottom=0.18)
+    if args.direction is None:
+        directions = ['upwelling','downwelling']
+    else:
+        directions = args.direction
+
+    if args.dark:
+        spectrum = 'Dark'
+    else:
+        spectrum = 'Light'
+
+    from matplotlib import pyplot
+    fig = pyplot.figure()
+    axes = setupAxes(fig, directions)
+    plotSpectra(fig, axes, args.picco, spectrum=spectrum, piccolo=use_piccolo_coeff,
+                maxLines=args.max_lines, decimate=args.decimate)
     pyplot.show()
     
 if __name__ == '__main__':
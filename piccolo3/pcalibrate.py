@@ -1,74 +1,94 @@
-from piccolo3.utils import CalibrateData, CalibrateConfig
+from piccolo3.utils import CalibrateData, CalibrateConfig, CalibrationSession
 import argparse
 import sys, os.path
-from matplotlib import pyplot
+import json
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 import numpy
-import pandas
 
 markers = "ov^<>spP*Dd"
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('spectra',nargs='*',help='the spectra files to load')
-    parser.add_argument('-c','--config',help="read config file")
-    parser.add_argument('-l','--spectral-lines',help="csv file containing spectral lines")
-    parser.add_argument('--min',type=float,default=5000.,help='minimum delta for peak, default 5000.')
-    parser.add_argument('-s','--saturation-percentage',type=float,default=90.,help='percentage of saturation level above which peaks are ignored')
-    parser.add_argument('-d','--direction',help="select the direction to process, default: process all directions")
-    parser.add_argument('-n','--serial-number',help="select the spectrometer to process, default: process all spectrometers")
-    parser.add_argument('-w','--wavelength',type=float,help="optimise for wavelength by applying a Gaussian weight centred at wavelength")
-    parser.add_argument('-g','--gaussian-width',type=float,default=100.,help='width of gaussian in nm, default=100.')
-    parser.add_argument('--shift',action='store_true',default=False,help='shift wavelengths to match center wavelength used for Gaussian weight')
-    parser.add_argument('-v','--version',action='store_true',default=False,help="print version and exit")
-    
-    args = parser.parse_args()
+def spectraFiles(paths):
+    """the list of spectra files, directories are searched for piccolo files"""
+    files = []
+    for p in paths:
+        if os.path.isdir(p):
+            files += sorted(str(f) for f in Path(p).rglob('*.pico'))
+        else:
+            files.append(p)
+    return files
 
-    if args.version:
-        from utils import __version__
-        print (__version__)
-        sys.exit(0)
+def _spectralLines(parser, args):
+    """the light sources given by the spectral lines files on the command line"""
+    if args.spectral_lines is not None:
+        spectralLinesNames = args.spectral_lines
+    else:
+        spectralLinesNames = [os.path.join(os.path.dirname(sys.argv[0]),'..','share','piccolo3-util','HgArLines.csv')]
+    if len(spectralLinesNames) > 1 and not args.identify:
+        parser.error('use a config file or --identify with more than one file containing spectral lines')
+
+    calibrate = {}
+    for spectralLinesName in spectralLinesNames:
+        if not os.path.isfile(spectralLinesName):
+            parser.error('could not find file containing spectra lines')
+        c = os.path.basename(spectralLinesName)
+        calibrate[c] = {'spectral_lines' : spectralLinesName, 'spectra' : []}
+    if not args.identify:
+        calibrate[c]['spectra'] = spectraFiles(args.spectra)
+    return calibrate
+
+def lightSources(parser, args):
+    """the light sources and spectra selected by the command line arguments
 
+    Returns
+    -------
+    dictionary of light sources containing the name of the spectral lines file
+    and the list of spectra files, and the list of spectra files whose light
+    source is identified automatically
+    """
     if args.config is not None:
         cfg = CalibrateConfig()
         cfg.readCfg(args.config)
         calibrate = cfg.cfg['calibrate']
     else:
-        if args.spectral_lines is not None:
-            spectralLinesName = args.spectral_lines
-        else:
-            spectralLinesName=os.path.join(os.path.dirname(sys.argv[0]),'..','share','piccolo2-util','HgArLines.csv')
-        if not os.path.isfile(spectralLinesName):
-            parser.error('could not find file containing spectra lines')
-            sys.exit(1)       
-            
-        calibrate = {}
-        c = os.path.basename(spectralLinesName)
-        calibrate[c] = {}
-        calibrate[c]['spectral_lines'] = spectralLinesName
-        calibrate[c]['spectra'] = args.spectra
-        
+        calibrate = _spectralLines(parser, args)
+
+    unknown = []
+    if args.identify:
+        unknown = spectraFiles(args.spectra)
+        for c in calibrate:
+            unknown += calibrate[c]['spectra']
+            calibrate[c]['spectra'] = []
+    return calibrate, unknown
+
+def loadCalibrationData(args, calibrate, unknown=[]):
+    """load the spectra of a single spectrometer and direction
 
+    The peaks are only found once all spectra are loaded.
+    """
     calibrationData = CalibrateData(args.serial_number,args.direction)
     calibrationData.minIntensity = args.min
     calibrationData.saturationPercentage = args.saturation_percentage
+    calibrationData.centroidMethod = args.centroid
+    calibrationData.combineMethod = args.combine
     for c in calibrate:
         calibrationData.addLightSource(c,calibrate[c]['spectral_lines'])
         for sf in calibrate[c]['spectra']:
-            calibrationData.addSpectrum(c,sf)
-            
-    if calibrationData.numSpectra == 0:
-        print ('no data')
-        sys.exit(1)
-
-    # match and optimise wavelengths
-    calibrationData.matchWavelength()
-    calibrationData.fitWavelength()
+            calibrationData.addSpectrum(c,sf,findPeaks=False)
+    for sf in unknown:
+        calibrationData.addSpectrum(None,sf,findPeaks=False)
+    calibrationData.findPeaks()
+    return calibrationData
 
-    print ('original',calibrationData.origCoeff)
-    print ('new', calibrationData.newCoeff)
+def plotCalibration(calibrationData, f):
+    """plot the original and new calibration
 
-    # plot data
-    f,ax = pyplot.subplots(2,2, sharex=True)
+    Parameters
+    ----------
+    calibrationData - the CalibrateData object to plot
+    f - the matplotlib figure to plot into
+    """
+    ax = f.subplots(2,2, sharex=True)
     spectralLinesColour = {}
     spectralLinesMarker = {}
     i = 0
@@ -81,29 +101,178 @@ def main():
         for l in calibrationData.spectralLines[s].lines:
             for j in range(2):
                 ax[0,j].axvline(l,color=spectralLinesColour[s])
-        matched = calibrationData.peaks[(calibrationData.peaks.lightSource==s) & (calibrationData.peaks.wavelength>0)]
-        w = calibrationData.origWavelength(matched.index.values)
-        ax[1,0].plot(w,matched.wavelength.values-w,'o',color=spectralLinesColour[s])
-        w = calibrationData.newWavelength(matched.index.values)
-        ax[1,1].plot(w,matched.wavelength.values-w,'o',color=spectralLinesColour[s])
+        _,positions,wavelengths = calibrationData.peakTable.peakPositions(s,matched=True)
+        w = calibrationData.origWavelength(positions)
+        ax[1,0].plot(w,wavelengths-w,'o',color=spectralLinesColour[s])
+        w = calibrationData.newWavelength(positions)
+        ax[1,1].plot(w,wavelengths-w,'o',color=spectralLinesColour[s])
 
+    origWavelength = calibrationData.origWavelengthGrid
+    newWavelength = calibrationData.newWavelengthGrid
     for i in range(calibrationData.numSpectra):
         c = 'C%d'%(i%10)
-        s = calibrationData.spectra[calibrationData.spectra.fileID==i]
-        ax[0,0].plot(s.orig_wavelength.values,s.intensity.values,color=c)
-        ax[0,1].plot(s.new_wavelength.values,s.intensity.values,color=c)
+        ax[0,0].plot(origWavelength,calibrationData.intensity[i],color=c)
+        ax[0,1].plot(newWavelength,calibrationData.intensity[i],color=c)
 
     for j in range(2):
-        ax[j,0].set_xlim(s.orig_wavelength.values[[0,-1]])
-        ax[j,1].set_xlim(s.new_wavelength.values[[0,-1]])
+        ax[j,0].set_xlim(origWavelength[[0,-1]])
+        ax[j,1].set_xlim(newWavelength[[0,-1]])
 
-    
-    pyplot.suptitle('%s %s'%(calibrationData.serialNumber,calibrationData.direction),fontsize=16)
+    f.suptitle('%s %s'%(calibrationData.serialNumber,calibrationData.direction),fontsize=16)
     ax[0,0].set_title('original')
     ax[0,1].set_title('new')
     ax[1,0].set_ylabel('mismatch at peaks')
     ax[0,0].set_ylabel('counts')
     ax[1,0].set_xlabel('wavelength')
     ax[1,1].set_xlabel('wavelength')
-        
+    return ax
+
+def _savePlot(calibrationData, fname):
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    f = Figure(figsize=(12,8))
+    FigureCanvasAgg(f)
+    plotCalibration(calibrationData, f)
+    f.savefig(fname)
+    return fname
+
+def calibrationResults(calibrationData):
+    """the coefficients and fit residuals as a dictionary
+
+    The coefficients are stored in increasing order like the piccolo
+    WavelengthCalibrationCoefficients.
+    """
+    results = {'original_coefficients' : list(calibrationData.origCoeff[::-1]),
+               'new_coefficients' : list(calibrationData.newCoeff[::-1]),
+               'number_of_spectra' : calibrationData.numSpectra,
+               'residuals' : {}}
+    allResiduals = []
+    for s in calibrationData.lightsources:
+        pixels,positions,wavelengths = calibrationData.peakTable.peakPositions(s,matched=True)
+        residuals = wavelengths-calibrationData.newWavelength(positions)
+        allResiduals.append(residuals)
+        results['residuals'][s] = {'pixel' : pixels.tolist(),
+                                   'position' : positions.tolist(),
+                                   'wavelength' : wavelengths.tolist(),
+                                   'original_residual' : (wavelengths-calibrationData.origWavelength(positions)).tolist(),
+                                   'new_residual' : residuals.tolist()}
+    fit = calibrationData.fitResult
+    if fit is not None:
+        results['fit'] = {'order' : fit.order,
+                          'orders' : fit.orders.tolist(),
+                          'rss' : fit.rss.tolist(),
+                          'cv' : fit.cv.tolist(),
+                          'sigma_clip_iterations' : fit.iterations,
+                          'number_of_rejected_peaks' : int(numpy.sum(~fit.mask))}
+    allResiduals = numpy.concatenate(allResiduals)
+    results['number_of_matched_peaks'] = len(allResiduals)
+    results['rms_residual'] = float(numpy.sqrt(numpy.mean(allResiduals**2))) if len(allResiduals) > 0 else None
+    return results
+
+def fitKeywords(args):
+    """the keyword arguments of CalibrateData.fitWavelength selected on the command line"""
+    return {'order' : args.order,
+            'maxOrder' : args.max_order,
+            'sigmaClip' : args.sigma_clip}
+
+def checkBatchArguments(parser, args):
+    """check the options that are only valid in batch mode"""
+    if args.plot_dir is not None:
+        if args.batch is None:
+            parser.error('plots can only be stored in batch mode')
+        if not os.path.isdir(args.plot_dir):
+            parser.error('plot directory %s is not a directory'%args.plot_dir)
+
+def batch(args, calibrate, unknown=[]):
+    """calibrate all spectrometers and directions without user interaction"""
+
+    session = CalibrationSession(serialNumber=args.serial_number, direction=args.direction,
+                                 minIntensity=args.min, saturationPercentage=args.saturation_percentage,
+                                 centroidMethod=args.centroid, combineMethod=args.combine)
+    for c in calibrate:
+        session.addLightSource(c,calibrate[c]['spectral_lines'])
+        for sf in calibrate[c]['spectra']:
+            session.addSpectrum(c,sf)
+    for sf in unknown:
+        session.addSpectrum(None,sf)
+
+    if len(session) == 0:
+        print ('no data')
+        sys.exit(1)
+
+    session.calibrate(jobs=args.jobs, optimseWavelength=args.wavelength, gaussianWidth=args.gaussian_width,
+                      **fitKeywords(args))
+
+    results = {}
+    for data in session:
+        if data.serialNumber not in results:
+            results[data.serialNumber] = {}
+        results[data.serialNumber][data.direction] = calibrationResults(data)
+    with open(args.batch,'w') as out:
+        json.dump(results,out,indent=2)
+
+    if args.plot_dir is not None:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            futures = [executor.submit(_savePlot, data,
+                                       os.path.join(args.plot_dir,'%s_%s.png'%(data.serialNumber,data.direction)))
+                       for data in session]
+            for f in futures:
+                f.result()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('spectra',nargs='*',help='the spectra files to load, directories are searched for piccolo files')
+    parser.add_argument('-c','--config',help="read config file")
+    parser.add_argument('-l','--spectral-lines',action='append',help="csv file containing spectral lines, can be repeated with --identify")
+    parser.add_argument('-i','--identify',action='store_true',default=False,help="identify the light source of each spectrum by matching its peaks against all spectral lines")
+    parser.add_argument('--min',type=float,default=5000.,help='minimum delta for peak, default 5000.')
+    parser.add_argument('-s','--saturation-percentage',type=float,default=90.,help='percentage of saturation level above which peaks are ignored')
+    parser.add_argument('-d','--direction',help="select the direction to process, default: process all directions")
+    parser.add_argument('-n','--serial-number',help="select the spectrometer to process, default: process all spectrometers")
+    parser.add_argument('-w','--wavelength',type=float,help="optimise for wavelength by applying a Gaussian weight centred at wavelength")
+    parser.add_argument('-g','--gaussian-width',type=float,default=100.,help='width of gaussian in nm, default=100.')
+    parser.add_argument('-o','--order',type=int,default=3,help='order of the polynomial, default: 3')
+    parser.add_argument('--max-order',type=int,help='select the order between 1 and MAX_ORDER with the lowest leave-one-out cross validation error')
+    parser.add_argument('--sigma-clip',type=float,help='iteratively ignore peaks whose residual exceeds SIGMA_CLIP times the RMS residual')
+    parser.add_argument('--centroid',choices=['parabolic','gaussian','centroid'],help='refine peak positions to sub-pixel accuracy using this method')
+    parser.add_argument('--combine',choices=['mean','median'],help='find the peaks once in the mean or median of all spectra of a light source ignoring saturated pixels')
+    parser.add_argument('--shift',action='store_true',default=False,help='shift wavelengths to match center wavelength used for Gaussian weight')
+    parser.add_argument('-b','--batch',metavar='OUTPUT',help="calibrate all spectrometers and directions without displaying the results, write coefficients and residuals to JSON file OUTPUT")
+    parser.add_argument('-p','--plot-dir',help="in batch mode store diagnostic plots in this directory")
+    parser.add_argument('-j','--jobs',type=int,help='number of parallel processes in batch mode, default: number of CPUs')
+    parser.add_argument('-v','--version',action='store_true',default=False,help="print version and exit")
+
+    args = parser.parse_args()
+
+    if args.version:
+        from utils import __version__
+        print (__version__)
+        sys.exit(0)
+
+    checkBatchArguments(parser, args)
+
+    calibrate, unknown = lightSources(parser, args)
+
+    if args.batch is not None:
+        batch(args, calibrate, unknown)
+        return
+
+    calibrationData = loadCalibrationData(args, calibrate, unknown)
+
+    if calibrationData.numSpectra == 0:
+        print ('no data')
+        sys.exit(1)
+
+    # match and optimise wavelengths
+    calibrationData.matchWavelength()
+    calibrationData.fitWavelength(**fitKeywords(args))
+
+    print ('original',calibrationData.origCoeff)
+    print ('new', calibrationData.newCoeff)
+
+    # plot data
+    from matplotlib import pyplot
+    f = pyplot.figure()
+    plotCalibration(calibrationData, f)
+
     pyplot.show()
@@ -0,0 +1,193 @@
+# Copyright 2014-2016 The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+"""render quicklook images of piccolo files without a display"""
+
+import argparse
+from piccolo3.common import piccoloLogging
+from piccolo3.disppicco import setupAxes, plotSpectra
+from piccolo3.dispdark import plotDarkPixels
+from piccolo3.utils.spectraPlot import DECIMATE_METHODS
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import logging
+import os.path
+import re
+
+# the figure of the worker process, it is reused between renders
+_figure = None
+_axes = None
+
+DATE = re.compile(r'"Datetime"\s*:\s*"(\d{4}-\d{2}-\d{2})')
+
+def fileDate(fname):
+    """the date of the first spectrum in a piccolo file, None if it has no date
+
+    The date is extracted with a regular expression, which is much faster
+    than parsing the file.
+    """
+    with open(fname,'r') as f:
+        m = DATE.search(f.read())
+    if m is None:
+        return None
+    return m.group(1)
+
+def _getFigure(options):
+    global _figure, _axes
+    if _figure is None:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        _figure = Figure(figsize=options['size'])
+        FigureCanvasAgg(_figure)
+        if options['darkPixels']:
+            _axes = {None : _figure.add_subplot(1,1,1)}
+        else:
+            _axes = setupAxes(_figure,options['directions'])
+    else:
+        # reuse the figure and axes, only remove what was drawn; clearing
+        # the axes would also recreate the ticks which is expensive
+        for ax in _axes.values():
+            _clearAxes(ax)
+        _figure.legends.clear()
+    return _figure, _axes
+
+def _clearAxes(ax):
+    for a in list(ax.collections)+list(ax.lines)+list(ax.images)+list(ax.patches)+list(ax.texts):
+        a.remove()
+    ax.containers.clear()
+    if ax.get_legend() is not None:
+        ax.get_legend().remove()
+    ax.relim()
+    ax.set_autoscale_on(True)
+    # restart the colour cycle
+    ax.set_prop_cycle(None)
+
+def render(outname, piccoFiles, options):
+    """render the piccolo files into the image outname
+
+    Parameters
+    ----------
+    outname - the name of the output image
+    piccoFiles - the names of the piccolo files
+    options - dictionary of rendering options
+    """
+    fig, axes = _getFigure(options)
+    if options['darkPixels']:
+        plotDarkPixels(axes[None], piccoFiles)
+    else:
+        plotSpectra(fig, axes, piccoFiles, spectrum=options['spectrum'], piccolo=options['piccolo'],
+                    maxLines=options['maxLines'], decimate=options['decimate'])
+    title = options.get('title')
+    if title is not None:
+        fig.suptitle(title)
+    outname = Path(outname)
+    if not outname.parent.exists():
+        os.makedirs(outname.parent,exist_ok=True)
+    fig.savefig(outname,dpi=options['dpi'])
+    return str(outname)
+
+def _render(job):
+    outname, piccoFiles, options = job
+    try:
+        return render(outname, piccoFiles, options)
+    except Exception as e:
+        logging.getLogger("piccolo.quicklook").error('failed to render %s: %s'%(outname,e))
+        return None
+
+def findFiles(paths):
+    """expand directories to the piccolo files they contain
+
+    Returns
+    -------
+    list of (name, path relative to its input directory) pairs
+    """
+    files = []
+    for p in paths:
+        p = Path(p)
+        if p.is_dir():
+            files += [(f,f.relative_to(p)) for f in sorted(p.rglob('*.pico'))]
+        else:
+            files.append((p,Path(p.name)))
+    return files
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('picco',metavar='PICCO',nargs='+',help='input piccolo json files or directories containing them')
+    parser.add_argument('-o','--output',default='.',help='the name of the output directory, default: current directory')
+    parser.add_argument('--per-day',action='store_true',default=False,help='render one image per day instead of one per file')
+    parser.add_argument('--direction',action='append',help='select directions to plot')
+    parser.add_argument('--dark',action='store_true',default=False,help='show dark spectra')
+    parser.add_argument('--dark-pixels',action='store_true',default=False,help='show the dark pixels normalised by integration time like piccolo3-display-dark')
+    parser.add_argument('-m','--max-lines',type=int,default=1000,help='maximum number of spectra per instrument and direction drawn individually, default: 1000')
+    parser.add_argument('--decimate',choices=DECIMATE_METHODS,default='envelope',help='how to draw more than MAX_LINES spectra, default: envelope')
+    parser.add_argument('--use-original-wavelength-coefficients',action='store_true',default=False,help='use original wavelength coefficients insteat of piccolo coefficients')
+    parser.add_argument('--dpi',type=int,default=100,help='resolution of the images, default: 100')
+    parser.add_argument('-j','--jobs',type=int,help='number of parallel processes, default: number of CPUs')
+    parser.add_argument('-d','--debug',action='store_true',default=False,help='enable debug')
+    args = parser.parse_args()
+
+    # start logging
+    piccoloLogging(debug=args.debug)
+    log = logging.getLogger("piccolo.quicklook")
+
+    out = Path(args.output)
+    if not out.is_dir():
+        parser.error(f'output directory {out} does not exist')
+
+    if args.direction is None:
+        directions = ['upwelling','downwelling']
+    else:
+        directions = args.direction
+    options = {'directions' : directions,
+               'spectrum' : 'Dark' if args.dark else 'Light',
+               'darkPixels' : args.dark_pixels,
+               'piccolo' : not args.use_original_wavelength_coefficients,
+               'maxLines' : args.max_lines,
+               'decimate' : args.decimate,
+               'dpi' : args.dpi,
+               'size' : (6.4*len(directions)/2+3.2,4.8)}
+
+    files = findFiles(args.picco)
+    if len(files) == 0:
+        parser.error('no piccolo files found')
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        if args.per_day:
+            days = {}
+            dates = executor.map(fileDate,[f for f,_ in files],chunksize=64)
+            for (f,_),date in zip(files,dates):
+                if date is None:
+                    log.warning('no date found in %s'%f)
+                    continue
+                days.setdefault(date,[]).append(str(f))
+            jobs = [(out.joinpath(d+'.png'),days[d],dict(options,title=d)) for d in sorted(days)]
+        else:
+            jobs = [(out.joinpath(r).with_suffix('.png'),[str(f)],dict(options,title=str(r))) for f,r in files]
+
+        # group small jobs to reduce the scheduling overhead
+        chunksize = max(1,len(jobs)//(4*(args.jobs or os.cpu_count() or 1)))
+        failed = 0
+        for job,result in zip(jobs,executor.map(_render,jobs,chunksize=chunksize)):
+            if result is None:
+                failed += 1
+            else:
+                log.info('wrote %s'%result)
+    if failed > 0:
+        log.error('failed to render %d images'%failed)
+
+if __name__ == '__main__':
+    main()
@@ -17,55 +17,198 @@
 
 import argparse
 from piccolo3.common import piccoloLogging
-from piccolo3.utils import read_radiometric_calibration
+from piccolo3.utils import read_radiometric_calibration, spectra_statistics
+from piccolo3.utils.PiccoloProcessedData import spectra_types
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import logging
+import numpy
 import xarray
 
-from matplotlib import pyplot
+def radiometric_calibration(dn, cal, statistic='mean', chunkSize=1000, sampleSize=1000, validFrom=None):
+    """compute the radiometric calibration coefficients
+
+    Parameters
+    ----------
+    dn: xarray dataset containing the dn spectra produced by piccolo3-read
+    cal: the calibration data returned by read_radiometric_calibration
+    statistic: the statistic of the dn spectra used, one of mean, median, trimmed-mean
+    chunkSize: the number of spectra processed at a time
+    sampleSize: maximum number of spectra used for estimating median and trimmed mean
+    validFrom: ISO date from which the calibration is valid, default: the time
+               of the first dn spectrum
+
+    Returns
+    -------
+    xarray dataset containing the calibration coefficients
+    """
+
+    # only use good pixels, the spectra are processed in chunks so that
+    # the dn data do not have to fit in memory
+    stats = spectra_statistics(dn.spectra.transpose('measurement','wavelengths'),
+                               chunkSize=chunkSize, minValue=1,
+                               robust=statistic != 'mean',
+                               reservoirSize=sampleSize)
+
+    mean_spectrum = stats.mean
+    variables = {'mean_spectrum' : (['wavelengths'], mean_spectrum),
+                 'std_spectrum' : (['wavelengths'], stats.std),
+                 'count' : (['wavelengths'], stats.count)}
+    if statistic == 'median':
+        mean_spectrum = stats.median
+        variables['median_spectrum'] = (['wavelengths'], mean_spectrum)
+    elif statistic == 'trimmed-mean':
+        mean_spectrum = stats.trimmedMean()
+        variables['trimmed_mean_spectrum'] = (['wavelengths'], mean_spectrum)
+    elif statistic != 'mean':
+        raise ValueError('unknown statistic %s'%statistic)
+
+    target = cal['spline'](dn.wavelengths.values)
+    coeff = target/mean_spectrum
+    variables['calibration_coeff'] = (['wavelengths'],coeff)
+
+    calibration = xarray.Dataset(variables,
+                                 coords = {'wavelengths' : dn.wavelengths})
+    calibration.attrs['statistic'] = statistic
+
+    for k in ['serial','direction']:
+        calibration.attrs[k] = dn.attrs[k]
+    if validFrom is None and 'time' in dn:
+        validFrom = numpy.datetime_as_string(dn.time.values.min(), unit='s')
+    if validFrom is not None:
+        calibration.attrs['valid_from'] = validFrom
+
+    return calibration
+
+def write_calibration(calibration, output, csv=False):
+    if csv:
+        calibration.to_dataframe().to_csv(output)
+    else:
+        calibration.to_netcdf(output)
+
+# the calibration data shared by all batch workers
+_calibrations = {}
+
+def _init_worker(calibrations):
+    global _calibrations
+    _calibrations = calibrations
+
+def _calibrate(dnName, calName, output, csv=False, **keywords):
+    with xarray.open_dataset(dnName) as dn:
+        calibration = radiometric_calibration(dn, _calibrations[calName], **keywords)
+    write_calibration(calibration, output, csv=csv)
+    return output
+
+def batch_calibration(dnFiles, calibrationMap, outdir, csv=False, jobs=None, **keywords):
+    """compute radiometric calibration coefficients for a set of instruments
+
+    Parameters
+    ----------
+    dnFiles: list of dn files produced by piccolo3-read, other files are skipped
+    calibrationMap: dictionary mapping the keys SERIAL_DIRECTION or DIRECTION or
+                    None (the default) to the names of lamp/sphere calibration files
+    outdir: the output directory
+    csv: store as csv files instead of netCDF
+    jobs: the number of worker processes, default number of CPUs
+    keywords: passed on to radiometric_calibration
+
+    Returns
+    -------
+    list of the names of the calibration files written
+    """
+    log = logging.getLogger("piccolo.calibrate")
+
+    # work out which calibration file to use for which dn file
+    tasks = []
+    for f in dnFiles:
+        with xarray.open_dataset(f) as dn:
+            # the directory may also contain calibration files written by a previous run
+            if 'spectra' not in dn or dn.spectra.attrs.get('description') != spectra_types['dn']['description']:
+                log.info('skipping %s, not a dn file'%f)
+                continue
+            serial = dn.attrs['serial']
+            direction = dn.attrs['direction']
+        for k in ['%s_%s'%(serial,direction), direction, None]:
+            if k in calibrationMap:
+                break
+        else:
+            log.warning('no calibration file for %s %s'%(serial,direction))
+            continue
+        suffix = 'csv' if csv else 'nc'
+        output = Path(outdir).joinpath('%s_%s_calibration.%s'%(serial,direction,suffix))
+        tasks.append((str(f), calibrationMap[k], str(output)))
+
+    # parse each calibration file only once, the parsed data are handed to
+    # each worker when it starts
+    calibrations = {}
+    for f,c,o in tasks:
+        if c not in calibrations:
+            log.info('reading calibration file %s'%c)
+            calibrations[c] = read_radiometric_calibration(c)
+
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(calibrations,)) as executor:
+        futures = [executor.submit(_calibrate, f, c, o, csv=csv, **keywords) for f,c,o in tasks]
+        for (f,c,o),future in zip(tasks,futures):
+            results.append(future.result())
+            log.info('calibrated %s using %s, wrote %s'%(f,c,o))
+    return results
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('dn',help='name of input dn file')
-    parser.add_argument('calibration',help='name of input calibration file')
+    parser.add_argument('dn',help='name of input dn file, in batch mode the directory containing the dn files')
+    parser.add_argument('calibration',help='name of input calibration file, in batch mode the default calibration file')
     parser.add_argument('-c','--store-csv',action='store_true',default=False,
                         help="store as csv file")
-    parser.add_argument('output',help='name of output calibration file')
+    parser.add_argument('output',help='name of output calibration file, in batch mode the output directory')
+    parser.add_argument('--statistic',choices=['mean','median','trimmed-mean'],default='mean',
+                        help="statistic of the dn spectra used to compute the calibration coefficients, the median and trimmed mean are estimated from a random sample of spectra, default: mean")
+    parser.add_argument('--chunk-size',type=int,default=1000,help='number of spectra processed at a time, default: 1000')
+    parser.add_argument('--sample-size',type=int,default=1000,help='maximum number of spectra used for estimating the median and trimmed mean, default: 1000')
+    parser.add_argument('--valid-from',metavar='DATE',help='ISO date from which the calibration is valid, default: the time of the first dn spectrum')
+    parser.add_argument('-b','--batch',action='store_true',default=False,help='process all dn files in a directory')
+    parser.add_argument('-m','--calibration-map',metavar='KEY=FILE',action='append',default=[],
+                        help='in batch mode use calibration file FILE for dn files matching KEY which is either a direction or SERIAL_DIRECTION, you can use this option multiple times')
+    parser.add_argument('-j','--jobs',type=int,help='number of parallel processes in batch mode, default: number of CPUs')
     parser.add_argument('-d','--debug',action='store_true',default=False,help='enable debug')
     args = parser.parse_args()
 
-    dn = xarray.open_dataset(args.dn)
-    cal = read_radiometric_calibration(args.calibration)
-
-    # only use good pixels
-    spectra = dn.spectra.where(dn.spectra>1)
-    
-    mean_spectrum = spectra.mean(dim='measurement')
-    target = cal['spline'](dn.wavelengths)
-    coeff = target/mean_spectrum
+    # start logging
+    piccoloLogging(debug=args.debug)
 
-    calibration = xarray.Dataset({'mean_spectrum' : (['wavelengths'], mean_spectrum),
-                                  'calibration_coeff' : (['wavelengths'],coeff)},
-                                 coords = {'wavelengths' : dn.wavelengths})
+    if args.valid_from is not None:
+        try:
+            numpy.datetime64(args.valid_from)
+        except ValueError:
+            parser.error(f'cannot parse date {args.valid_from}')
 
+    keywords = {'statistic' : args.statistic,
+                'chunkSize' : args.chunk_size,
+                'sampleSize' : args.sample_size,
+                'validFrom' : args.valid_from}
 
-    for k in ['serial','direction']:
-        calibration.attrs[k] = dn.attrs[k]
-
-    if args.store_csv:
-        calibration.to_dataframe().to_csv(args.output)
+    if args.batch:
+        dndir = Path(args.dn)
+        if not dndir.is_dir():
+            parser.error(f'dn directory {dndir} is not a directory')
+        outdir = Path(args.output)
+        if not outdir.is_dir():
+            parser.error(f'output directory {outdir} is not a directory')
+        calibrationMap = {None : args.calibration}
+        for m in args.calibration_map:
+            try:
+                k,f = m.split('=',1)
+            except ValueError:
+                parser.error(f'calibration map {m} is not of the form KEY=FILE')
+            calibrationMap[k] = f
+        batch_calibration(sorted(dndir.glob('*.nc')), calibrationMap, outdir,
+                          csv=args.store_csv, jobs=args.jobs, **keywords)
     else:
-        calibration.to_netcdf(args.output)
-    
-    if False:
-        f, (ax1, ax2, ax3) = pyplot.subplots(3, 1, sharex=True)
-        ax1.plot(dn.wavelengths,mean_spectrum)
-        ax1.set_ylabel('corrected and normalised dn')
-        ax2.plot(dn.wavelengths,target)
-        ax2.set_ylabel('radiometric')
-        ax3.plot(dn.wavelengths,coeff)
-        ax3.set_xlabel('wavelength')
-        ax3.set_ylabel('calibration coefficients')
-    
-        pyplot.show()
+        dn = xarray.open_dataset(args.dn)
+        cal = read_radiometric_calibration(args.calibration)
+        calibration = radiometric_calibration(dn, cal, **keywords)
+        write_calibration(calibration, args.output, csv=args.store_csv)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,108 @@
+# Copyright 2014-2016 The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+from piccolo3.common import piccoloLogging
+from piccolo3.utils import compute_reflectance
+import logging
+from pathlib import Path
+import xarray
+
+def sortFiles(files):
+    """sort the calibrated files by direction and serial number
+
+    Returns
+    -------
+    dictionaries mapping the serial numbers to the lists of upwelling and
+    of downwelling files
+    """
+    log = logging.getLogger("piccolo.reflectance")
+
+    upwelling = {}
+    downwelling = {}
+    for f in files:
+        with xarray.open_dataset(f) as ds:
+            s = ds.attrs['serial']
+            c = ds.attrs['direction']
+        if c == 'Upwelling':
+            upwelling.setdefault(s,[]).append(f)
+        elif c == 'Downwelling':
+            downwelling.setdefault(s,[]).append(f)
+        else:
+            log.warning('ignoring file %s with direction %s'%(f,c))
+    return upwelling, downwelling
+
+def reflectance(upName, downName, outname, chunkSize=1000):
+    """compute the reflectance of the spectra in an upwelling file and write them to outname
+
+    Returns
+    -------
+    the number of reflectance spectra written, None on error
+    """
+    log = logging.getLogger("piccolo.reflectance")
+
+    log.info('pairing %s with %s, writing %s'%(upName,downName,outname))
+    with xarray.open_dataset(upName) as up, xarray.open_dataset(downName) as down:
+        try:
+            return compute_reflectance(up, down, outname, chunkSize=chunkSize)
+        except RuntimeError as e:
+            log.error(str(e))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('data',metavar='DATA',nargs='+',help='input calibrated files produced by piccolo3-apply-calibration')
+    parser.add_argument('-D','--downwelling',help='pair the upwelling spectra of all instruments with the downwelling spectra in this file, default: use the downwelling spectra of the same instrument')
+    parser.add_argument('-p','--prefix',default='.',help='the name of the output directory')
+    parser.add_argument('--chunk-size',type=int,default=1000,help='number of spectra processed at a time, default: 1000')
+    parser.add_argument('-d','--debug',action='store_true',default=False,help='enable debug')
+    args = parser.parse_args()
+
+    # start logging
+    piccoloLogging(debug=args.debug)
+    log = logging.getLogger("piccolo.reflectance")
+
+    out = Path(args.prefix)
+    if not out.exists():
+        parser.error(f'output directory {out} does not exist')
+    if not out.is_dir():
+        parser.error(f'output directory {out} is not a directory')
+
+    upwelling, downwelling = sortFiles(args.data)
+
+    for s in upwelling:
+        if args.downwelling is not None:
+            d = args.downwelling
+        elif s in downwelling:
+            d = downwelling[s][-1]
+            if len(downwelling[s]) > 1:
+                log.warning('using downwelling file %s for %s, ignoring %s'%(d,s,', '.join(downwelling[s][:-1])))
+        else:
+            log.error('no downwelling spectra for %s'%s)
+            continue
+        # each upwelling file is processed separately, the output is named
+        # after the input file when an instrument has several of them
+        for f in upwelling[s]:
+            if len(upwelling[s]) == 1:
+                outname = out.joinpath('%s_Reflectance.nc'%s)
+            else:
+                outname = out.joinpath('%s_Reflectance.nc'%Path(f).stem)
+            n = reflectance(f, d, outname, chunkSize=args.chunk_size)
+            if n is not None:
+                log.info('wrote %d reflectance spectra for %s'%(n,f))
+
+if __name__ == '__main__':
+    main()
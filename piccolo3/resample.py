@@ -0,0 +1,64 @@
+# Copyright 2014-2016 The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+from piccolo3.common import piccoloLogging
+from piccolo3.utils import resample_spectra
+import logging
+from pathlib import Path
+import xarray
+import numpy
+
+def main():
+    from piccolo3.utils.resample import RESAMPLE_METHODS
+    parser = argparse.ArgumentParser()
+    parser.add_argument('data',metavar='DATA',nargs='+',help='input files produced by piccolo3-read, piccolo3-apply-calibration or piccolo3-reflectance')
+    parser.add_argument('-p','--prefix',default='.',help='the name of the output directory')
+    parser.add_argument('--start',type=float,default=400.,help='the first wavelength of the common grid in nm, default: 400')
+    parser.add_argument('--stop',type=float,default=1000.,help='the last wavelength of the common grid in nm, default: 1000')
+    parser.add_argument('--step',type=float,default=1.,help='the spacing of the common grid in nm, default: 1')
+    parser.add_argument('-m','--method',choices=RESAMPLE_METHODS,default='linear',help='linear interpolation or convolution with a Gaussian, default: linear')
+    parser.add_argument('--fwhm',type=float,help='the full width at half maximum of the Gaussian in nm, default: the grid spacing')
+    parser.add_argument('--chunk-size',type=int,default=1000,help='number of spectra processed at a time, default: 1000')
+    parser.add_argument('-d','--debug',action='store_true',default=False,help='enable debug')
+    args = parser.parse_args()
+
+    # start logging
+    piccoloLogging(debug=args.debug)
+    log = logging.getLogger("piccolo.resample")
+
+    out = Path(args.prefix)
+    if not out.exists():
+        parser.error(f'output directory {out} does not exist')
+    if not out.is_dir():
+        parser.error(f'output directory {out} is not a directory')
+    if args.step <= 0 or args.stop < args.start:
+        parser.error('the common grid is empty')
+
+    wavelengths = numpy.arange(args.start, args.stop+args.step/2, args.step)
+
+    for f in args.data:
+        outname = out.joinpath(Path(f).name)
+        if outname.resolve() == Path(f).resolve():
+            log.error('refusing to overwrite input file %s'%f)
+            continue
+        log.info('resampling %s, writing %s'%(f,outname))
+        with xarray.open_dataset(f) as ds:
+            resample_spectra(ds, wavelengths, outname, method=args.method, fwhm=args.fwhm, chunkSize=args.chunk_size)
+
+if __name__ == '__main__':
+    main()
@@ -18,7 +18,37 @@
 __all__ = ['main']
 
 from PyQt5 import QtCore, QtGui, QtWidgets
+import numpy
 from . import calibrate_ui
+from .wavelengthFit import fit_polynomial
+
+class FitSignals(QtCore.QObject):
+    """signals emitted by the fit worker, carrying the generation of the request"""
+    finished = QtCore.pyqtSignal(int,object)
+    failed = QtCore.pyqtSignal(int,str)
+
+class FitWorker(QtCore.QRunnable):
+    """fit the wavelengths in a background thread
+
+    The worker only sees copies of the peak positions and wavelengths so
+    that the peak table can be edited while it runs.
+    """
+    def __init__(self,generation,positions,wavelengths,weights,order):
+        QtCore.QRunnable.__init__(self)
+        self.generation = generation
+        self.positions = positions
+        self.wavelengths = wavelengths
+        self.weights = weights
+        self.order = order
+        self.signals = FitSignals()
+
+    def run(self):
+        try:
+            fit = fit_polynomial(self.positions,self.wavelengths,maxOrder=self.order,order=self.order,weights=self.weights)
+        except Exception as e:
+            self.signals.failed.emit(self.generation,str(e))
+            return
+        self.signals.finished.emit(self.generation,fit)
 
 class SpectralLinesDelegate(QtWidgets.QItemDelegate):
 
@@ -44,43 +74,117 @@ class SpectralLinesDelegate(QtWidgets.QItemDelegate):
     def currentIndexChanged(self):
         self.commitData.emit(self.sender())
 
-class Peaks(QtGui.QStandardItemModel):
+class Peaks(QtCore.QAbstractTableModel):
+    """table model of the peaks of a light source
+
+    The model reads directly from the arrays of the peak table. A sorted
+    index of the new wavelengths is used to find the row of a picked peak.
+    """
+
+    HEADERS = ['pixel','wavelength','spectral line']
+
     def __init__(self,*args,**keywords):
         self.pdata = keywords['data']
         del keywords['data']
         
-        QtGui.QStandardItemModel.__init__(self,*args,**keywords)
+        QtCore.QAbstractTableModel.__init__(self,*args,**keywords)
+        self.lightsource = None
+        self._pixels = numpy.zeros(0,dtype=int)
+        self._positions = numpy.zeros(0)
+        self._wavelengths = numpy.zeros(0)
+        self._newWavelengths = numpy.zeros(0)
+        self._sortedRows = numpy.zeros(0,dtype=int)
+        self._highlighted = None
 
     def selectLightSource(self,lightsource):
-        peaks = self.pdata.peaks[self.pdata.peaks.lightSource==lightsource]
-        self.clear()
-        self.setHorizontalHeaderLabels(['pixel','wavelength','spectral line'])
-        self.setColumnCount(3)
-        self.setRowCount(len(peaks))
+        self.beginResetModel()
+        self.lightsource = lightsource
+        self._pixels,self._positions,self._wavelengths = self.pdata.peakTable.peakPositions(lightsource)
+        self._highlighted = None
+        self._updateNewWavelengths()
+        self.endResetModel()
 
-        i = 0
-        for pixel,row in peaks.iterrows():
-            item = QtGui.QStandardItem(str(pixel))
-            item.setEditable(False)
-            self.setItem(i,0,item)
-            item = QtGui.QStandardItem(str(self.pdata.newWavelength(pixel)))
-            item.setEditable(False)
-            self.setItem(i,1,item)
-            item = QtGui.QStandardItem(str(row.wavelength))
-            self.setItem(i,2,item)
-            i = i+1
+    def _updateNewWavelengths(self):
+        if self.pdata.newCoeff is None:
+            self._newWavelengths = self.pdata.origWavelength(self._positions)
+        else:
+            self._newWavelengths = self.pdata.newWavelength(self._positions)
+        self._sortedRows = numpy.argsort(self._newWavelengths)
 
-    def highlightWavelength(self,wavelength):
-        for r in range(self.rowCount()):
-            if abs(float(self.item(r,1).text())-wavelength) < 1e-8:
-                self.item(r,1).setForeground(QtGui.QBrush(QtGui.QColor('green')))
+    def updateWavelengths(self):
+        """recompute the new wavelengths after a refit"""
+        self._updateNewWavelengths()
+        if self.rowCount() > 0:
+            self.dataChanged.emit(self.index(0,1),self.index(self.rowCount()-1,1))
+
+    def rowCount(self,parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._pixels)
+
+    def columnCount(self,parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.HEADERS)
+
+    def headerData(self,section,orientation,role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and orientation == QtCore.Qt.Horizontal:
+            return self.HEADERS[section]
+        return QtCore.QAbstractTableModel.headerData(self,section,orientation,role)
+
+    def flags(self,index):
+        f = QtCore.Qt.ItemIsSelectable | QtCore.Qt.ItemIsEnabled
+        if index.column() == 2:
+            f |= QtCore.Qt.ItemIsEditable
+        return f
+
+    def data(self,index,role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        r = index.row()
+        c = index.column()
+        if role in [QtCore.Qt.DisplayRole, QtCore.Qt.EditRole]:
+            if c == 0:
+                return str(self._pixels[r])
+            elif c == 1:
+                return str(self._newWavelengths[r])
             else:
-                self.item(r,1).setForeground(QtGui.QBrush(QtGui.QColor('black')))
+                return str(self._wavelengths[r])
+        if role == QtCore.Qt.ForegroundRole and c == 1 and r == self._highlighted:
+            return QtGui.QBrush(QtGui.QColor('green'))
+        return None
 
-    def setData(self,index,data):
-        pixel = int(self.item(index.row(),column=0).text())
-        QtGui.QStandardItemModel.setData(self,index,data)
-        self.pdata.peaks.loc[pixel].wavelength = float(data)
+    def rowOfWavelength(self,wavelength,tolerance=1e-8):
+        """the row of the peak with the given new wavelength, None if there is no such peak"""
+        n = len(self._sortedRows)
+        if n == 0:
+            return None
+        w = self._newWavelengths[self._sortedRows]
+        i = numpy.searchsorted(w,wavelength)
+        candidates = [j for j in [i-1,i] if 0 <= j < n]
+        j = min(candidates,key=lambda j: abs(w[j]-wavelength))
+        if abs(w[j]-wavelength) > tolerance:
+            return None
+        return int(self._sortedRows[j])
+
+    def highlightWavelength(self,wavelength):
+        rows = [self._highlighted]
+        self._highlighted = self.rowOfWavelength(wavelength)
+        rows.append(self._highlighted)
+        for r in rows:
+            if r is not None:
+                self.dataChanged.emit(self.index(r,1),self.index(r,1),[QtCore.Qt.ForegroundRole])
+
+    def setData(self,index,data,role=QtCore.Qt.EditRole):
+        if not index.isValid() or index.column() != 2 or role != QtCore.Qt.EditRole:
+            return False
+        r = index.row()
+        wavelength = float(data)
+        # update the peak table first, the views are notified by the model
+        self.pdata.setPeakWavelength(self.lightsource,self._pixels[r],wavelength)
+        self._wavelengths[r] = wavelength
+        self.dataChanged.emit(index,index,[QtCore.Qt.DisplayRole,QtCore.Qt.EditRole])
+        return True
 
 class Coeffs(QtGui.QStandardItemModel):
     def __init__(self,*args,**keywords):
@@ -101,6 +205,9 @@ class Coeffs(QtGui.QStandardItemModel):
             self.setItem(0,i,item)
         
 class CalibrateApp(QtWidgets.QMainWindow, calibrate_ui.Ui_MainWindow):
+    # delay in ms before repeated edits trigger a refit
+    FIT_DELAY = 300
+
     def __init__(self, calibrationData, parent=None):
         super(CalibrateApp, self).__init__()
         self.setupUi(self)
@@ -118,14 +225,26 @@ class CalibrateApp(QtWidgets.QMainWindow, calibrate_ui.Ui_MainWindow):
 
         # the peaks table
         self.tableView.setModel(self.peaks)
+        self.peaks.dataChanged.connect(self.peaksChanged)
 
         # the coeff view
         self.coeffView.setModel(self.coeff)
 
+        # fits run in a single background thread, only the result of the
+        # latest request is applied
+        self.fitPool = QtCore.QThreadPool(self)
+        self.fitPool.setMaxThreadCount(1)
+        self.fitGeneration = 0
+        self.fitWorkers = {}
+        self.fitTimer = QtCore.QTimer(self)
+        self.fitTimer.setSingleShot(True)
+        self.fitTimer.setInterval(self.FIT_DELAY)
+        self.fitTimer.timeout.connect(self.fitWavelengths)
+
         # hook up polyorder
         self.order = None
         self.changeOrder()
-        self.polynomialOrder.editingFinished.connect(self.changeOrder)
+        self.polynomialOrder.valueChanged.connect(self.changeOrder)
 
         # the calculate button
         self.calculateCoeffs.clicked.connect(self.fitWavelengths)
@@ -142,13 +261,50 @@ class CalibrateApp(QtWidgets.QMainWindow, calibrate_ui.Ui_MainWindow):
         self.peaks.selectLightSource(ls)
         self.tableView.setItemDelegateForColumn(2, SpectralLinesDelegate(self,self.calibrationData,ls))
 
+    def peaksChanged(self,topLeft,bottomRight):
+        # only the spectral line column affects the residuals
+        if topLeft.column() <= 2 <= bottomRight.column():
+            self.calibratePlot.updateResiduals()
+            self.scheduleFit()
+
     def changeOrder(self):
-        self.order = self.polynomialOrder.value()
-        
+        order = self.polynomialOrder.value()
+        if order != self.order:
+            self.order = order
+            self.scheduleFit()
+
+    def scheduleFit(self):
+        """refit once the edits have stopped for FIT_DELAY ms"""
+        self.fitTimer.start()
+
     def fitWavelengths(self):
+        """start fitting the wavelengths in the background"""
+        self.fitTimer.stop()
+        self.fitGeneration += 1
+        positions,wavelengths,weights = self.calibrationData.fitInput()
+        worker = FitWorker(self.fitGeneration,positions,wavelengths,weights,self.order)
+        worker.signals.finished.connect(self.fitFinished)
+        worker.signals.failed.connect(self.fitFailed)
+        # keep the signals alive until the worker reports back
+        self.fitWorkers[self.fitGeneration] = worker
+        self.statusbar.showMessage('fitting polynomial of order %d'%self.order)
+        self.fitPool.start(worker)
+
+    def fitFailed(self,generation,msg):
+        del self.fitWorkers[generation]
+        if generation == self.fitGeneration:
+            self.statusbar.showMessage(msg)
+
+    def fitFinished(self,generation,fit):
+        del self.fitWorkers[generation]
+        if generation != self.fitGeneration:
+            # a newer fit is on its way
+            return
+        self.statusbar.clearMessage()
         ls = self.lightSourceSelector.currentText()
-        self.calibrationData.fitWavelength(order=self.order)
+        self.calibrationData.applyFit(fit)
         self.calibratePlot.plotData(ls)
+        self.peaks.updateWavelengths()
         self.coeff.updateData()
         self.coeffView.resizeColumnsToContents()
         height = (self.coeffView.horizontalScrollBar().height() +
@@ -19,6 +19,7 @@ __all__ = ['CalibratePlot']
 
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.figure import Figure
+from matplotlib.collections import LineCollection
 import time
 from PyQt5 import QtCore
 import numpy
@@ -30,15 +31,21 @@ class CalibratePlot(FigureCanvas):
         super(CalibratePlot,self).__init__(Figure())
         self.setParent(parent)
 
-        self.figure = Figure()
-        self.canvas = FigureCanvas(self.figure)
         self.misfitCallback = None
 
-        self.canvas.mpl_connect('pick_event', self.onpick)
+        # draw and blit on this canvas so that the animated residuals show up
+        self.mpl_connect('pick_event', self.onpick)
+        self.mpl_connect('draw_event', self._onDraw)
 
         self.data = None
         self._theplot = None
 
+        # persistent artists of the current light source
+        self._lightsource = None
+        self._spectrumLines = []
+        self._residuals = None
+        self._background = None
+
         self.draw()
         
     @property
@@ -63,26 +70,86 @@ class CalibratePlot(FigureCanvas):
             print (w)
     
     def plotData(self,lightsource):
+        """plot the spectra and residuals of a light source
+
+        The artists are only created when the light source changes, after
+        a refit they are updated in place.
+        """
+        if lightsource != self._lightsource:
+            self._setupPlot(lightsource)
+
+        w = self.data.newWavelengthGrid
+        if w is None:
+            w = self.data.origWavelengthGrid
+        for line in self._spectrumLines:
+            line.set_xdata(w)
+        self.theplot[0].set_xlim(w[0],w[-1])
+
+        self._setResiduals()
+        self._scaleResiduals()
+        self.draw_idle()
 
+    def updateResiduals(self):
+        """redraw only the residual panel after the matched lines change"""
+        if self._residuals is None:
+            return
+        self._setResiduals()
+        if self._background is None or not self._residualsVisible():
+            self._scaleResiduals()
+            self.draw_idle()
+            return
+        ax = self.theplot[1]
+        self.restore_region(self._background)
+        ax.draw_artist(self._residuals)
+        self.blit(ax.bbox)
+
+    def _setupPlot(self,lightsource):
         for i in range(2):
             self.theplot[i].clear()
-        
-        for l in self.data.spectralLines[lightsource].lines:
-            self.theplot[0].axvline(l,color='k')
-                
-        spectra = self.data.spectra[self.data.spectra.lightSource==lightsource]
-        fileIDs = numpy.unique(spectra.fileID.values)
-        fileIDs.sort()
-        for fid in fileIDs:
-            c = 'C%d'%(fid%10)
-            s = spectra[spectra.fileID==fid]
-
-            self.theplot[0].plot(s.new_wavelength.values,s.intensity.values,color=c)
-
-        self.theplot[0].set_xlim(s.new_wavelength.values[0],s.new_wavelength.values[-1])
-
-        matched = self.data.peaks[(self.data.peaks.lightSource==lightsource) & (self.data.peaks.wavelength>0)]
-        w = self.data.newWavelength(matched.index.values)
-        self.theplot[1].plot(w,matched.wavelength.values-w,'ob',picker=5)
-        
-        self.draw()
+        self._lightsource = lightsource
+
+        # the spectral lines span the whole height of the axes
+        ax = self.theplot[0]
+        lines = self.data.spectralLines[lightsource].wavelengths
+        segments = numpy.zeros((len(lines),2,2))
+        segments[:,:,0] = lines[:,None]
+        segments[:,1,1] = 1
+        ax.add_collection(LineCollection(segments,colors='k',transform=ax.get_xaxis_transform()))
+
+        self._spectrumLines = []
+        intensity = self.data.intensity
+        w = self.data.origWavelengthGrid
+        for fid in numpy.flatnonzero(self.data.spectrumLightSource==lightsource):
+            self._spectrumLines += ax.plot(w,intensity[fid],color='C%d'%(fid%10))
+
+        # the residuals are drawn separately so that they can be blitted
+        self._residuals, = self.theplot[1].plot([],[],'ob',picker=5,animated=True)
+        self._background = None
+
+    def _setResiduals(self):
+        _,positions,wavelengths = self.data.peakTable.peakPositions(self._lightsource,matched=True)
+        w = self.data.newWavelength(positions)
+        self._residuals.set_data(w,wavelengths-w)
+
+    def _residualsVisible(self):
+        r = self._residuals.get_ydata()
+        if len(r) == 0:
+            return True
+        lo,hi = self.theplot[1].get_ylim()
+        return r.min() >= lo and r.max() <= hi
+
+    def _scaleResiduals(self):
+        r = self._residuals.get_ydata()
+        if len(r) == 0:
+            return
+        lo,hi = r.min(),r.max()
+        margin = 0.05*(hi-lo) if hi>lo else 0.5
+        self.theplot[1].set_ylim(lo-margin,hi+margin)
+
+    def _onDraw(self,event):
+        """store the background of the residual panel and draw the residuals"""
+        if self._residuals is None:
+            return
+        ax = self.theplot[1]
+        self._background = self.copy_from_bbox(ax.bbox)
+        ax.draw_artist(self._residuals)
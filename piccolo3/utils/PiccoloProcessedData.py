@@ -43,6 +43,12 @@ spectra_types = {
         'units':'W/(cm^2 nm)',
         'corrections':'nonlin, total_dark, integration_time_normalised',
     },
+
+    'Reflectance' : {
+        'description' : 'reflectance factor pi*radiance/irradiance',
+        'units':'1',
+        'corrections':'nonlin, total_dark, integration_time_normalised',
+    },
 }
 
 class PiccoloProcessedData:
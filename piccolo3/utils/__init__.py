@@ -15,14 +15,78 @@
 # You should have received a copy of the GNU General Public License
 # along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
 
-from pkg_resources import get_distribution, DistributionNotFound
-try:
-    __version__ = get_distribution('piccolo3-utils').version
-except DistributionNotFound:
-    # package is not installed
-    pass
-
-from .PiccoloProcessedData import *
-from .read_radiometric_calibration import *
-from .calibrateConfig import *
-from .calibrateData import *
+"""piccolo3 utility modules
+
+The submodules pull in heavy dependencies (xarray, pandas, scipy, ...). They
+are only imported when one of their names is first accessed so that the
+command line tools only pay for what they use.
+"""
+
+import importlib
+import sys
+import types
+
+# map public names to the submodule providing them
+_lazy_names = {
+    'PiccoloProcessedData' : 'PiccoloProcessedData',
+    'read_picco' : 'PiccoloProcessedData',
+    'read_radiometric_calibration' : 'read_radiometric_calibration',
+    'evaluate_radiometric_calibration' : 'read_radiometric_calibration',
+    'CalibrateConfig' : 'calibrateConfig',
+    'CalibrateData' : 'calibrateData',
+    'PeakTable' : 'peakTable',
+    'CalibrationSession' : 'calibrationSession',
+    'PolynomialFit' : 'wavelengthFit',
+    'fit_polynomial' : 'wavelengthFit',
+    'refine_peaks' : 'peakCentroid',
+    'combine_spectra' : 'combineSpectra',
+    'LightSourceClassifier' : 'lightSourceClassifier',
+    'plot_spectra' : 'spectraPlot',
+    'DarkStatistics' : 'darkStatistics',
+    'DarkTrend' : 'darkTrend',
+    'SpectraStatistics' : 'spectraStatistics',
+    'spectra_statistics' : 'spectraStatistics',
+    'aggregate_spectra' : 'aggregate',
+    'RadiometricCalibrations' : 'applyCalibration',
+    'read_calibrations' : 'applyCalibration',
+    'apply_radiometric_calibration' : 'applyCalibration',
+    'pair_spectra' : 'reflectance',
+    'interpolation_weights' : 'reflectance',
+    'compute_reflectance' : 'reflectance',
+    'resample' : 'resample',
+    'resampling_matrix' : 'resample',
+    'resample_spectra' : 'resample',
+}
+
+__all__ = list(_lazy_names.keys())
+
+class _LazyModule(types.ModuleType):
+    def __setattr__(self, name, value):
+        # the import system binds a freshly imported submodule to the package;
+        # where the submodule shares its name with the object it exports keep
+        # the public name pointing at that object
+        if isinstance(value, types.ModuleType) and _lazy_names.get(name) == name:
+            value = getattr(value, name, value)
+        super().__setattr__(name, value)
+
+sys.modules[__name__].__class__ = _LazyModule
+
+def __getattr__(name):
+    if name == '__version__':
+        from importlib.metadata import version, PackageNotFoundError
+        try:
+            v = version('piccolo3-utils')
+        except PackageNotFoundError:
+            # package is not installed
+            raise AttributeError(name)
+        globals()[name] = v
+        return v
+    if name in _lazy_names:
+        module = importlib.import_module('.'+_lazy_names[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+def __dir__():
+    return sorted(list(globals().keys()) + __all__ + ['__version__'])
@@ -0,0 +1,172 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ['PERCENTILES','aggregate_spectra']
+
+from .spectraStatistics import SpectraStatistics
+from .chunkedNetCDF import ChunkedNetCDFWriter, iter_chunks
+import numpy
+import pandas
+import xarray
+
+PERCENTILES = [5,25,50,75,95]
+
+class _Bin(object):
+    """the running statistics of the spectra in a bin"""
+
+    def __init__(self, spectral, scalar, robust, reservoirSize):
+        self.stats = {n : SpectraStatistics(robust=robust, reservoirSize=reservoirSize) for n in spectral}
+        self.sums = {n : 0. for n in scalar}
+        self.counts = {n : 0 for n in scalar}
+        self.start = None
+        self.end = None
+        self.numSpectra = 0
+
+    def update(self, chunk, rows):
+        for n in self.stats:
+            self.stats[n].update(chunk[n][rows])
+        for n in self.sums:
+            v = chunk[n][rows]
+            valid = numpy.isfinite(v)
+            self.sums[n] += numpy.sum(v[valid])
+            self.counts[n] += numpy.sum(valid)
+        self.numSpectra += len(rows)
+        t = chunk['time'][rows]
+        if self.start is None:
+            self.start = t.min()
+            self.end = t.max()
+        else:
+            self.start = min(self.start, t.min())
+            self.end = max(self.end, t.max())
+
+def _labels(ds, freq, byBatch):
+    """the bin code of each measurement and the coordinates of the bins"""
+    keys = []
+    names = []
+    if byBatch:
+        keys += [ds.runs.values, ds.batches.values]
+        names += ['runs','batches']
+    if freq is not None:
+        keys.append(pandas.DatetimeIndex(ds.time.values).floor(freq).values)
+        names.append('time')
+    codes, bins = pandas.MultiIndex.from_arrays(keys).factorize()
+    return codes, bins.set_names(names)
+
+def aggregate_spectra(ds, output, freq=None, byBatch=False, percentiles=PERCENTILES,
+                      chunkSize=1000, reservoirSize=10000):
+    """aggregate the spectra of a dataset by time and/or run and batch
+
+    The dataset is read in a single pass one chunk at a time. The spectra of
+    each bin are accumulated until the last spectrum of the bin has been
+    read, the statistics of the bin are then appended to the output file.
+    When the data are ordered in time only the bins of the current chunk
+    are held in memory.
+
+    The mean, standard deviation and count of every spectral variable are
+    exact. The percentiles are exact for bins containing at most
+    reservoirSize spectra, otherwise they are estimated from a random sample.
+    Other floating point variables, such as temperature, are averaged.
+
+    Parameters
+    ----------
+    ds: xarray dataset produced by piccolo3-read, piccolo3-apply-calibration,
+        piccolo3-reflectance or piccolo3-resample
+    output: the name of the output netCDF file
+    freq: the length of the time bins as a pandas frequency string, eg 1min,
+          10min or 1D
+    byBatch: bin by run and batch
+    percentiles: the percentiles to compute
+    chunkSize: the number of spectra processed at a time
+    reservoirSize: the maximum number of spectra per bin used for the percentiles
+
+    Returns
+    -------
+    the number of bins
+    """
+    if freq is None and not byBatch:
+        raise ValueError('spectra must be aggregated by time and/or batch')
+    percentiles = list(percentiles)
+    spectral = [n for n in ds.data_vars if ds[n].dims == ('measurement','wavelengths') or ds[n].dims == ('wavelengths','measurement')]
+    scalar = [n for n in ds.data_vars if ds[n].dims == ('measurement',) and ds[n].dtype.kind == 'f']
+
+    codes, bins = _labels(ds, freq, byBatch)
+    # the position of the last spectrum of each bin
+    last = numpy.zeros(len(bins), dtype=int)
+    numpy.maximum.at(last, codes, numpy.arange(len(codes)))
+
+    attrs = dict(ds.attrs)
+    attrs['aggregation_frequency'] = freq if freq is not None else 'none'
+    attrs['aggregation_by_batch'] = int(byBatch)
+    attrs['percentiles'] = ', '.join('%g'%q for q in percentiles)
+
+    current = {}
+    writer = ChunkedNetCDFWriter(output)
+    start = 0
+    for chunk in iter_chunks(ds, chunkSize=chunkSize):
+        n = chunk.sizes['measurement']
+        c = codes[start:start+n]
+        values = {v : chunk[v].transpose('measurement','wavelengths').values for v in spectral}
+        values.update({v : chunk[v].values for v in scalar})
+        values['time'] = chunk.time.values
+        order = numpy.argsort(c, kind='stable')
+        b, first = numpy.unique(c[order], return_index=True)
+        for code, rows in zip(b, numpy.split(order, first[1:])):
+            if code not in current:
+                current[code] = _Bin(spectral, scalar, len(percentiles)>0, reservoirSize)
+            current[code].update(values, rows)
+        start += n
+
+        # write the bins that are complete in the order of their last spectrum
+        done = sorted((code for code in current if last[code] < start), key=lambda code: last[code])
+        if len(done) > 0:
+            writer.write(_dataset(ds, done, [current.pop(code) for code in done], bins, percentiles, attrs))
+    return len(bins)
+
+def _dataset(ds, codes, data, bins, percentiles, attrs):
+    """the statistics of a list of bins"""
+    result = xarray.Dataset()
+    for n in data[0].stats:
+        var = ds[n]
+        mean = numpy.array([d.stats[n].mean for d in data])
+        std = numpy.array([d.stats[n].std for d in data])
+        count = numpy.array([d.stats[n].count for d in data])
+        result[n] = (['measurement','wavelengths'], mean, var.attrs)
+        result[n+'_std'] = (['measurement','wavelengths'], std, var.attrs)
+        result[n+'_count'] = (['measurement','wavelengths'], count)
+        if len(percentiles) > 0:
+            p = numpy.array([d.stats[n].percentile(percentiles) for d in data])
+            for i,q in enumerate(percentiles):
+                result[n+'_p%s'%('%g'%q).replace('.','_')] = (['measurement','wavelengths'], p[:,i], var.attrs)
+    for n in data[0].sums:
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            result[n] = (['measurement'], numpy.array([d.sums[n]/d.counts[n] for d in data]), ds[n].attrs)
+    result['number_of_spectra'] = (['measurement'], numpy.array([d.numSpectra for d in data]))
+    result['time_start'] = (['measurement'], numpy.array([d.start for d in data]))
+    result['time_end'] = (['measurement'], numpy.array([d.end for d in data]))
+
+    coords = {'wavelengths' : ds.wavelengths}
+    b = bins[codes]
+    if 'runs' in b.names:
+        coords['runs'] = (['measurement'], b.get_level_values('runs').values)
+        coords['batches'] = (['measurement'], b.get_level_values('batches').values)
+    if 'time' in b.names:
+        result['time'] = (['measurement'], b.get_level_values('time').values)
+    else:
+        result['time'] = (['measurement'], numpy.array([d.start for d in data]))
+    result = result.assign_coords(coords)
+    result.attrs = attrs
+    return result
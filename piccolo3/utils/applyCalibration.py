@@ -0,0 +1,154 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ['RadiometricCalibrations','read_calibrations','apply_radiometric_calibration']
+
+from .PiccoloProcessedData import spectra_types
+from .chunkedNetCDF import ChunkedNetCDFWriter, iter_chunks
+import numpy
+import xarray
+import logging
+import glob
+
+# calibrations without a valid_from attribute are valid from the beginning of time
+EARLIEST = numpy.datetime64('0001-01-01T00:00:00','s')
+
+class RadiometricCalibrations(object):
+    """the radiometric calibrations of a single instrument ordered by time"""
+
+    def __init__(self, serial, direction):
+        """
+        Parameters
+        ----------
+        serial: the serial number of the spectrometer
+        direction: the direction
+        """
+        self._serial = serial
+        self._direction = direction
+        self._calibrations = {}
+        self._log = logging.getLogger("piccolo.calibration")
+
+    @property
+    def serial(self):
+        return self._serial
+    @property
+    def direction(self):
+        return self._direction
+    @property
+    def validFrom(self):
+        """sorted array of the times from which the calibrations are valid"""
+        return numpy.array(sorted(self._calibrations.keys()),dtype='datetime64[s]')
+
+    def __len__(self):
+        return len(self._calibrations)
+
+    def add(self, cal):
+        """add a calibration dataset produced by piccolo3-calibrate"""
+        if cal.serial != self.serial or cal.direction != self.direction:
+            raise RuntimeError('calibration for %s %s does not match %s %s'%(cal.serial,cal.direction,self.serial,self.direction))
+        if 'valid_from' in cal.attrs:
+            t = numpy.datetime64(cal.attrs['valid_from'],'s')
+        else:
+            t = EARLIEST
+        if t in self._calibrations:
+            self._log.warning('already got calibration for %s %s valid from %s'%(self.serial,self.direction,t))
+        self._calibrations[t] = cal
+
+    def coefficients(self, wavelengths):
+        """the calibration coefficients, one row per calibration ordered by time
+
+        Parameters
+        ----------
+        wavelengths: the wavelengths of the data to be calibrated, they must match
+                     the wavelengths of the calibrations
+        """
+        coeffs = []
+        for t in sorted(self._calibrations.keys()):
+            cal = self._calibrations[t]
+            if len(cal.wavelengths) != len(wavelengths) or not numpy.allclose(cal.wavelengths.values,wavelengths):
+                raise RuntimeError('wavelengths of calibration for %s %s valid from %s do not match the data'%(self.serial,self.direction,t))
+            coeffs.append(cal.calibration_coeff.values)
+        return numpy.array(coeffs)
+
+    def select(self, times):
+        """the index of the calibration to be used for each time"""
+        validFrom = self.validFrom
+        idx = numpy.searchsorted(validFrom, numpy.asarray(times).astype('datetime64[s]'), side='right')-1
+        if numpy.any(idx<0):
+            self._log.warning('%d spectra of %s %s predate the first calibration, using the earliest calibration'%(numpy.sum(idx<0),self.serial,self.direction))
+        return numpy.maximum(idx,0)
+
+def read_calibrations(calibration):
+    """read radiometric calibration files
+
+    Parameters
+    ----------
+    calibration: list of calibration file names, can contain wildcards
+
+    Returns
+    -------
+    a dictionary indexed by serial number and direction of RadiometricCalibrations
+    """
+    log = logging.getLogger("piccolo.calibration")
+    calibrations = {}
+    for c in calibration:
+        for f in glob.glob(c):
+            log.info('reading calibration file %s'%f)
+            cal = xarray.open_dataset(f).load()
+            if cal.serial not in calibrations:
+                calibrations[cal.serial] = {}
+            if cal.direction not in calibrations[cal.serial]:
+                calibrations[cal.serial][cal.direction] = RadiometricCalibrations(cal.serial,cal.direction)
+            calibrations[cal.serial][cal.direction].add(cal)
+    return calibrations
+
+def apply_radiometric_calibration(dn, calibrations, output, chunkSize=1000):
+    """apply radiometric calibration to a dn dataset
+
+    The dn data are processed in chunks and written to the output file one
+    chunk at a time. Each spectrum is calibrated using the latest calibration
+    that is valid at the time the spectrum was recorded.
+
+    Parameters
+    ----------
+    dn: xarray dataset containing dn spectra produced by piccolo3-read
+    calibrations: the RadiometricCalibrations for the instrument
+    output: the name of the output netCDF file
+    chunkSize: the number of spectra processed at a time
+    """
+    if dn.attrs['serial'] != calibrations.serial or dn.attrs['direction'] != calibrations.direction:
+        raise RuntimeError('calibration for %s %s does not match data for %s %s'%(calibrations.serial,calibrations.direction,dn.attrs['serial'],dn.attrs['direction']))
+    if dn.spectra.attrs.get('description') != spectra_types['dn']['description']:
+        raise RuntimeError('data for %s %s are not dn spectra'%(calibrations.serial,calibrations.direction))
+    if len(calibrations) == 0:
+        raise RuntimeError('no calibration for %s %s'%(calibrations.serial,calibrations.direction))
+
+    coeffs = calibrations.coefficients(dn.wavelengths.values)
+    attrs = dict(dn.spectra.attrs)
+    attrs.update(spectra_types[calibrations.direction])
+
+    writer = ChunkedNetCDFWriter(output)
+    for chunk in iter_chunks(dn, chunkSize=chunkSize):
+        if len(calibrations) > 1:
+            idx = calibrations.select(chunk.time.values)
+        else:
+            idx = numpy.zeros(chunk.sizes['measurement'],dtype=int)
+        spectra = chunk.spectra.transpose('measurement','wavelengths')
+        chunk['spectra'] = (spectra.dims, spectra.values*coeffs[idx], attrs)
+        chunk['calibration_index'] = (['measurement'], idx)
+        chunk.attrs['calibration_valid_from'] = ', '.join(str(t) for t in calibrations.validFrom)
+        writer.write(chunk)
@@ -0,0 +1,44 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ['cache_dir']
+
+import os
+from pathlib import Path
+import logging
+
+def cache_dir(create=True):
+    """the directory used for caching intermediate data
+
+    The directory can be set using the environment variable
+    PICCOLO3_CACHE_DIR, otherwise the piccolo3-utils directory in the
+    user's cache directory is used. Returns None if the directory does not
+    exist and cannot be created.
+    """
+    if 'PICCOLO3_CACHE_DIR' in os.environ:
+        path = Path(os.environ['PICCOLO3_CACHE_DIR'])
+    else:
+        path = Path(os.environ.get('XDG_CACHE_HOME',Path.home().joinpath('.cache')),'piccolo3-utils')
+    if not path.is_dir():
+        if not create:
+            return None
+        try:
+            path.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            logging.getLogger("piccolo.cache").warning('cannot create cache directory %s: %s'%(path,e))
+            return None
+    return path
@@ -23,8 +23,15 @@
 __all__ = ['CalibrateData']
 
 import numpy, pandas
+import logging
+from collections import OrderedDict
 from sortedcontainers import SortedSet
 from .matchSpectralLines import PiccoloSpectralLines
+from .peakTable import PeakTable
+from .wavelengthFit import fit_polynomial
+from .peakCentroid import refine_peaks, CENTROID_METHODS
+from .combineSpectra import combine_spectra, COMBINE_METHODS
+from .lightSourceClassifier import LightSourceClassifier
 from piccolo3.common import PiccoloSpectraList
 from scipy.signal import find_peaks
 
@@ -34,6 +41,9 @@ def gaussian(a,b,c,x):
 class CalibrateData(object):
     """main data structure holding calibration data"""
 
+    # the number of sets of new wavelengths kept
+    WAVELENGTH_CACHE_SIZE = 8
+
     def __init__(self,serialNumber, direction):
         """
         Parameters
@@ -46,19 +56,36 @@ class CalibrateData(object):
         self._direction = direction
 
         self._spectralLines = {}
+        self._classifier = None
 
         self._piccoFiles = []
-        self._spectra = pandas.DataFrame(columns = ['pixel','intensity','orig_wavelength','fileID','lightSource','new_wavelength'])
+        # the spectra are stored column wise: a pixel axis shared by all
+        # spectra, one row of intensities per spectrum and per spectrum metadata
+        self._pixels = None
+        self._intensity = []
+        self._intensityArray = None
+        self._spectrumLightSource = []
+        self._origWavelength = None
+        # wavelengths of the pixel axis indexed by the new coefficients
+        self._newWavelength = OrderedDict()
+        self._spectra = None
         
-        self._peaks = pandas.DataFrame(columns = ['pixel','lightSource','wavelength']).set_index('pixel')
+        self._peaks = PeakTable()
 
         self._origCoeffs = None
         self._origPoly = None
         self._newCoeffs = None
         self._newPoly = None
+        self._fitResult = None
 
         self._saturation = None
         self._minIntensity = None
+
+        self._centroidMethod = None
+        self._centroidHalfWidth = 2
+        # combine the spectra of each light source before finding peaks
+        self._combineMethod = None
+        self._combined = {}
         self._maxIntensity = None
         
     @property
@@ -80,8 +107,67 @@ class CalibrateData(object):
         ls.sort()
         return ls
     @property
+    def pixels(self):
+        """the pixel axis shared by all spectra"""
+        return self._pixels
+    @property
+    def intensity(self):
+        """2D array of intensities, one row per spectrum"""
+        if self._intensityArray is None or len(self._intensityArray) != len(self._intensity):
+            if len(self._intensity) == 0:
+                return None
+            self._intensityArray = numpy.array(self._intensity)
+        return self._intensityArray
+    @property
+    def spectrumLightSource(self):
+        """array containing the light source of each spectrum"""
+        return numpy.array(self._spectrumLightSource,dtype=object)
+    @property
+    def origWavelengthGrid(self):
+        """the wavelengths of the pixel axis using the original coefficients"""
+        return self._origWavelength
+    @property
+    def newWavelengthGrid(self):
+        """the wavelengths of the pixel axis using the new coefficients
+
+        The polynomial is evaluated once on the pixel axis when first needed
+        and the result is cached by coefficients.
+        """
+        if self.pixels is None or self.newCoeff is None:
+            return None
+        key = self.newCoeff.tobytes()
+        if key in self._newWavelength:
+            self._newWavelength.move_to_end(key)
+        else:
+            self._newWavelength[key] = self.newWavelength(self.pixels)
+            self._newWavelength[key].flags.writeable = False
+            if len(self._newWavelength) > self.WAVELENGTH_CACHE_SIZE:
+                self._newWavelength.popitem(last=False)
+        return self._newWavelength[key]
+    @property
     def spectra(self):
-        """pandas dataframe containing all spectra"""
+        """pandas dataframe containing all spectra
+
+        The dataframe is constructed from the column store when it is first
+        accessed after the spectra or the wavelengths change.
+        """
+        if self._spectra is None:
+            n = self.numSpectra
+            if n == 0:
+                self._spectra = pandas.DataFrame(columns = ['pixel','intensity','orig_wavelength','fileID','lightSource','new_wavelength'])
+            else:
+                nPixels = len(self.pixels)
+                if self.newWavelengthGrid is None:
+                    newWavelength = numpy.full(n*nPixels,numpy.nan)
+                else:
+                    newWavelength = numpy.tile(self.newWavelengthGrid,n)
+                self._spectra = pandas.DataFrame({
+                    'pixel' : numpy.tile(self.pixels,n),
+                    'intensity' : self.intensity.ravel(),
+                    'orig_wavelength' : numpy.tile(self._origWavelength,n),
+                    'fileID' : numpy.repeat(numpy.arange(n),nPixels),
+                    'lightSource' : pandas.Categorical(numpy.repeat(self.spectrumLightSource,nPixels)),
+                    'new_wavelength' : newWavelength})
         return self._spectra
     @property
     def numSpectra(self):
@@ -132,8 +218,58 @@ class CalibrateData(object):
         else:
             return self.maxIntensity
     @property
+    def centroidMethod(self):
+        """method used to refine peak positions to sub-pixel accuracy, None to use integer pixels"""
+        return self._centroidMethod
+    @centroidMethod.setter
+    def centroidMethod(self,method):
+        if method is not None and method not in CENTROID_METHODS:
+            raise RuntimeError('unknown centroid method %s'%method)
+        if method != self._centroidMethod:
+            self._centroidMethod = method
+            self._refinePeakTable()
+    @property
+    def centroidHalfWidth(self):
+        """half width of the window used by the centroid method"""
+        return self._centroidHalfWidth
+    @centroidHalfWidth.setter
+    def centroidHalfWidth(self,arg):
+        a = int(arg)
+        assert a>0
+        if a != self._centroidHalfWidth:
+            self._centroidHalfWidth = a
+            self._refinePeakTable()
+    @property
+    def combineMethod(self):
+        """method used to combine the spectra of a light source before finding peaks, None to find the peaks of each spectrum"""
+        return self._combineMethod
+    @combineMethod.setter
+    def combineMethod(self,method):
+        if method is not None and method not in COMBINE_METHODS:
+            raise RuntimeError('unknown combine method %s'%method)
+        if method != self._combineMethod:
+            self._combineMethod = method
+            # the combined spectra depend on the method
+            self._combined = {}
+            if self.numSpectra > 0:
+                self.findPeaks()
+    def combinedIntensity(self,lightSource):
+        """the combined spectrum of a light source, None if the spectra are not combined"""
+        if self.combineMethod is None:
+            return None
+        if lightSource not in self._combined:
+            spectra = self.intensity[self.spectrumLightSource==lightSource]
+            if len(spectra) == 0:
+                return None
+            self._combined[lightSource] = combine_spectra(spectra,saturation=self._saturation,method=self.combineMethod)
+        return self._combined[lightSource]
+    @property
     def peaks(self):
         """a pandas dataframe containing the peaks and associated wavelength for each light source"""
+        return self._peaks.frame
+    @property
+    def peakTable(self):
+        """the table of peaks keyed by fileID, light source and pixel"""
         return self._peaks
     @property
     def origCoeff(self):
@@ -169,11 +305,16 @@ class CalibrateData(object):
     @newCoeff.setter
     def newCoeff(self,coeffs):
         c = numpy.array(coeffs,dtype=float)
-        if self._newCoeffs is None or len(c)!=len(self._newCoeffs) or numpy.all(numpy.abs(c-self._newCoeffs)>1e-14):
+        if self._newCoeffs is None or len(c)!=len(self._newCoeffs) or numpy.any(numpy.abs(c-self._newCoeffs)>1e-14):
             self._newCoeffs = c
             self._newPoly  = None
+            # the new wavelengths are computed when they are needed
             self.updateNewWavelength()
     @property
+    def fitResult(self):
+        """the result of the last wavelength fit"""
+        return self._fitResult
+    @property
     def newPoly(self):
         """polynomial object using new wavelength coefficients"""
         if self._newPoly is None:
@@ -202,75 +343,284 @@ class CalibrateData(object):
         if name in self.spectralLines:
             raise RuntimeError('light source %s is already loaded'%name)
         self.spectralLines[name] = PiccoloSpectralLines(spectralLines)
-        
+        self._classifier = None
+
+    @property
+    def classifier(self):
+        """classifier identifying the light source of a spectrum from the loaded spectral lines"""
+        if self._classifier is None:
+            self._classifier = LightSourceClassifier()
+            for l in self.spectralLines:
+                self._classifier.addLightSource(l,self.spectralLines[l])
+        return self._classifier
 
-    def addSpectrum(self,lightSource,piccoFile):
+    def addSpectrum(self,lightSource,piccoFile,findPeaks=True):
         """
         add a spectrum
 
         Parameters
         ----------
-        lightSource - the name of the light source used to collect the spectra
+        lightSource - the name of the light source used to collect the spectra,
+                      None to identify the light source of each spectrum
         piccoFile - the name of the piccolo file to be loaded
+        findPeaks - find the peaks of the new spectra, when loading many files
+                    set to False and call findPeaks once all files are loaded
         """
 
-        if lightSource not in self.spectralLines:
+        if lightSource is not None and lightSource not in self.spectralLines:
             raise RuntimeError('light source %s not registered'%lightSource)
         
         with open(piccoFile,'r') as inFile:
             spectra = PiccoloSpectraList(data=inFile.read())
 
             # loop over spectra
+            added = set()
             for s in spectra:
-                sn = s['SerialNumber']
-                dr = s['Direction']
-                if sn != self.serialNumber or dr != self.direction:
-                    # not the data we are looking for
+                if s['SerialNumber'] != self.serialNumber or s['Direction'] != self.direction:
                     continue
+                ls = lightSource
+                if ls is None:
+                    ls = self.identifyLightSource(s)
+                    if ls is None:
+                        logging.getLogger("piccolo.calibrate").warning('could not identify light source of spectrum in %s'%piccoFile)
+                        continue
+                if self.addPiccoloSpectrum(ls,s,piccoFile,findPeaks=findPeaks and self.combineMethod is None):
+                    added.add(ls)
+            # the combined spectrum is only searched once per file
+            if findPeaks and self.combineMethod is not None:
+                for ls in added:
+                    self.findPeaks(ls)
 
+    def identifyLightSource(self,spectrum):
+        """
+        the name of the light source best matching the peaks of a spectrum
 
-                self.origCoeff = s['WavelengthCalibrationCoefficients'][::-1]
-                if self._saturation is None:
-                    self._saturation = s['SaturationLevel']
-                if self.saturationPercentage is None:
-                    # use 80% of saturation
-                    self.saturationPercentage = 80
+        Parameters
+        ----------
+        spectrum - the piccolo spectrum
+
+        Returns
+        -------
+        the name of the light source, None if no light source matches
+        """
+        saturationPercentage = self.saturationPercentage
+        if saturationPercentage is None:
+            saturationPercentage = 80
+        return self.classifier.identifySpectrum(spectrum,minIntensity=self.minIntensity,
+                                                saturationPercentage=saturationPercentage)
+
+    def addPiccoloSpectrum(self,lightSource,spectrum,piccoFile=None,findPeaks=True):
+        """
+        add a single spectrum
+
+        Parameters
+        ----------
+        lightSource - the name of the light source used to collect the spectrum
+        spectrum - the piccolo spectrum
+        piccoFile - the name of the piccolo file the spectrum was read from
+        findPeaks - find the peaks of the spectrum, otherwise call findPeaks later
+
+        Returns
+        -------
+        True if the spectrum was added, False if it belongs to a different
+        spectrometer or direction
+        """
+
+        if lightSource not in self.spectralLines:
+            raise RuntimeError('light source %s not registered'%lightSource)
+
+        s = spectrum
+        sn = s['SerialNumber']
+        dr = s['Direction']
+        if sn != self.serialNumber or dr != self.direction:
+            # not the data we are looking for
+            return False
+
+        self.origCoeff = s['WavelengthCalibrationCoefficients'][::-1]
+        if self._saturation is None:
+            self._saturation = s['SaturationLevel']
+            # saturated pixels are excluded from the combined spectra
+            self._combined = {}
+        if self.saturationPercentage is None:
+            # use 80% of saturation
+            self.saturationPercentage = 80
+
+        nPixels = s.getNumberOfPixels()
+        if self._pixels is None:
+            self._pixels = numpy.arange(nPixels)
+            self._origWavelength = self.origWavelength(self._pixels)
+        elif nPixels != len(self._pixels):
+            raise RuntimeError('expected %d pixels, got %d'%(len(self._pixels),nPixels))
+
+        fileID = len(self._intensity)
+        self._intensity.append(numpy.asarray(s.pixels,dtype=float))
+        self._spectrumLightSource.append(lightSource)
+        self._spectra = None
+        self._combined.pop(lightSource,None)
+
+        # all good, add processed file to list of files
+        self._piccoFiles.append(piccoFile)
+
+        # find the peaks
+        if findPeaks:
+            if self.combineMethod is None:
+                self._findPeaks(fileID)
+            else:
+                self.findPeaks(lightSource)
+        return True
+
+    def _refine(self,spectra,rows,pixels):
+        """the sub-pixel positions of peaks, None if no centroid method is set"""
+        if self.centroidMethod is None:
+            return None
+        return refine_peaks(spectra,rows,pixels,method=self.centroidMethod,halfWidth=self.centroidHalfWidth)
+
+    def _refinePeakTable(self):
+        """recompute the positions of all peaks in the peak table"""
+        if len(self._peaks) == 0:
+            return
+        spectra = self.intensity
+        rows = self._peaks.fileID
+        if self.combineMethod is not None:
+            # peaks of the combined spectra are refined on the combined spectra
+            lightSources = [l for l in self.lightsources if self.combinedIntensity(l) is not None]
+            spectra = numpy.vstack([spectra]+[self.combinedIntensity(l) for l in lightSources])
+            combinedRow = dict((l,len(self.intensity)+i) for i,l in enumerate(lightSources))
+            rows = rows.copy()
+            peakLightSources = self._peaks.lightSource
+            for l in combinedRow:
+                rows[(rows<0) & (peakLightSources==l)] = combinedRow[l]
+        positions = self._refine(spectra,rows,self._peaks.pixel)
+        if positions is None:
+            positions = self._peaks.pixel
+        self._peaks.setPositions(positions)
+
+    def _findPeaks(self,fileID):
+        spectrum = self._intensity[fileID]
+        peaks,_ = find_peaks(spectrum,height= self.peakHeight)
+        positions = self._refine(spectrum[None,:],numpy.zeros(len(peaks),dtype=int),peaks)
+        self._peaks.add(fileID,self._spectrumLightSource[fileID],peaks,positions)
+
+    def findPeaks(self,lightSource=None):
+        """find the peaks of all spectra, this discards any matched wavelengths
+
+        The sub-pixel positions of all peaks are refined together. When a
+        combine method is set the peaks are only searched in the combined
+        spectrum of each light source.
+
+        Parameters
+        ----------
+        lightSource - only find the peaks of this light source, default: all light sources
+        """
+        if lightSource is None:
+            self._peaks = PeakTable()
+            lightSources = self.lightsources
+        else:
+            self._peaks.remove(lightSource)
+            lightSources = [lightSource]
+        if self.numSpectra == 0:
+            return
+        if self.combineMethod is not None:
+            for l in lightSources:
+                spectrum = self.combinedIntensity(l)
+                if spectrum is None:
+                    continue
+                peaks,_ = find_peaks(spectrum,height= self.peakHeight)
+                positions = self._refine(spectrum[None,:],numpy.zeros(len(peaks),dtype=int),peaks)
+                self._peaks.add(-1,l,peaks,positions)
+            return
+        spectra = self.intensity
+        spectrumLightSources = self.spectrumLightSource
+        for l in lightSources:
+            rows = []
+            pixels = []
+            for fileID in numpy.flatnonzero(spectrumLightSources==l):
+                peaks,_ = find_peaks(spectra[fileID],height= self.peakHeight)
+                rows.append(numpy.full(len(peaks),fileID))
+                pixels.append(peaks)
+            if len(rows) == 0:
+                continue
+            rows = numpy.concatenate(rows)
+            pixels = numpy.concatenate(pixels)
+            self._peaks.add(rows,l,pixels,self._refine(spectra,rows,pixels))
+
+    def setPeakWavelength(self,lightSource,pixel,wavelength):
+        """
+        set the wavelength of the spectral line matching a peak
+
+        Parameters
+        ----------
+        lightSource - the name of the light source
+        pixel - the pixel of the peak
+        wavelength - the wavelength, -1 to remove the match
+        """
+        self._peaks.setWavelengthByPixel(lightSource,pixel,wavelength)
 
-                fileID = self.numSpectra
-                nPixels = s.getNumberOfPixels()
-                
-                data = {'pixel' : numpy.arange(nPixels),
-                        'intensity' : s.pixels,
-                        'fileID' : [fileID]*nPixels,
-                        'lightSource' : [lightSource]*nPixels
-                        }
-                data['orig_wavelength'] = self.origWavelength(data['pixel'])
-                data = pandas.DataFrame(data)
-                self._spectra = self._spectra.append(data,ignore_index=True)
-
-                # find the peaks
-                peaks,_ = find_peaks(s.pixels,height= self.peakHeight)
-                for p in peaks:
-                    self.peaks.loc[p] = {'lightSource':lightSource,'wavelength':-1}
-                self._peaks = self._peaks.sort_index()
-
-                # all good, add processed file to list of files
-                self._piccoFiles.append(piccoFile)
-    
     def matchWavelength(self):
         for l in self.spectralLines:
-            peaks = self.peaks[self.peaks==l].index.values
-            p = zip(peaks,self.origWavelength(peaks))
-            for p,w in self.spectralLines[l].match(p):
-                self.peaks.loc[p].wavelength = w
+            peaks,positions,_ = self._peaks.peakPositions(l)
+            matched = self.spectralLines[l].match(zip(peaks,self.origWavelength(positions)))
+            if len(matched) > 0:
+                p,w = numpy.array(matched).T
+                self._peaks.setWavelengthByPixel(l,p,w)
 
-    def fitWavelength(self,order=3,optimseWavelength=None,gaussianWidth=100):
-        p = self.peaks[self.peaks.wavelength>0]
+    def fitInput(self,optimseWavelength=None,gaussianWidth=100):
+        """
+        copies of the positions and wavelengths of the matched peaks and the weights used for fitting
+
+        Parameters
+        ----------
+        optimseWavelength - apply a Gaussian weight centred at this wavelength
+        gaussianWidth - the width of the Gaussian weight
+
+        Returns
+        -------
+        array of positions, array of wavelengths and array of weights or None
+        """
+        _,pixels,wavelengths = self._peaks.peakPositions(matched=True)
         if optimseWavelength is not None:
-            weights = 0.5+gaussian(0.5,optimseWavelength,gaussianWidth,p.index.values)
+            weights = 0.5+gaussian(0.5,optimseWavelength,gaussianWidth,pixels)
         else:
             weights = None
-        self.newCoeff = numpy.polyfit(p.index.values,p.wavelength.values,order,w=weights)
+        return pixels.copy(),wavelengths.copy(),weights
+
+    def computeFit(self,order=3,optimseWavelength=None,gaussianWidth=100,maxOrder=None,sigmaClip=None):
+        """
+        fit the wavelengths of the matched peaks without changing the coefficients
+
+        Parameters
+        ----------
+        order - the order of the polynomial
+        optimseWavelength - apply a Gaussian weight centred at this wavelength
+        gaussianWidth - the width of the Gaussian weight
+        maxOrder - select the order between 1 and maxOrder with the lowest
+                   leave-one-out cross validation error instead of using order
+        sigmaClip - iteratively remove peaks whose residual exceeds sigmaClip
+                    times the RMS residual
+
+        Returns
+        -------
+        a PolynomialFit object
+        """
+        pixels,wavelengths,weights = self.fitInput(optimseWavelength=optimseWavelength,gaussianWidth=gaussianWidth)
+        if maxOrder is None:
+            return fit_polynomial(pixels,wavelengths,maxOrder=order,order=order,weights=weights,sigmaClip=sigmaClip)
+        else:
+            return fit_polynomial(pixels,wavelengths,maxOrder=maxOrder,weights=weights,sigmaClip=sigmaClip)
+
+    def fitWavelength(self,order=3,optimseWavelength=None,gaussianWidth=100,maxOrder=None,sigmaClip=None):
+        """fit the wavelengths of the matched peaks and set the new coefficients
+
+        see computeFit for the parameters
+        """
+        self.applyFit(self.computeFit(order=order,optimseWavelength=optimseWavelength,gaussianWidth=gaussianWidth,
+                                      maxOrder=maxOrder,sigmaClip=sigmaClip))
+
+    def applyFit(self,fit):
+        """set the new coefficients from a PolynomialFit computed by computeFit"""
+        self._fitResult = fit
+        self.newCoeff = fit.coeffs
                 
     def updateNewWavelength(self):
-        self.spectra.new_wavelength[:] = self.newWavelength(self.spectra.pixel.values)
+        """discard the spectra dataframe so that it picks up the new wavelengths"""
+        self._spectra = None
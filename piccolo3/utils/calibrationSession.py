@@ -0,0 +1,173 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ['CalibrationSession']
+
+from .calibrateData import CalibrateData
+from .lightSourceClassifier import LightSourceClassifier
+import logging
+from piccolo3.common import PiccoloSpectraList
+from concurrent.futures import ProcessPoolExecutor
+
+def _calibrate(data, keywords):
+    data.findPeaks()
+    data.matchWavelength()
+    data.fitWavelength(**keywords)
+    return data
+
+class CalibrationSession(object):
+    """wavelength calibration of several spectrometers and directions
+
+    Each piccolo file is parsed once and its spectra are passed on to the
+    CalibrateData object of the spectrometer and direction they belong to.
+    """
+
+    def __init__(self, serialNumber=None, direction=None, minIntensity=None, saturationPercentage=None, centroidMethod=None,
+                 combineMethod=None):
+        """
+        Parameters
+        ----------
+        serialNumber: only calibrate this spectrometer, default: all spectrometers
+        direction: only calibrate this direction, default: all directions
+        minIntensity: the minimum intensity considered for finding peaks
+        saturationPercentage: the maximum intensity considered for finding peaks
+                              as a percentage of the saturation level
+        centroidMethod: method used to refine peak positions to sub-pixel accuracy
+        combineMethod: method used to combine the spectra of each light source
+                       before finding peaks
+        """
+        self._serialNumber = serialNumber
+        self._direction = direction
+        self._minIntensity = minIntensity
+        self._saturationPercentage = saturationPercentage
+        self._centroidMethod = centroidMethod
+        self._combineMethod = combineMethod
+
+        self._spectralLines = {}
+        self._classifier = LightSourceClassifier()
+        self._data = {}
+
+    @property
+    def instruments(self):
+        """sorted list of (serial number, direction) pairs"""
+        return sorted(self._data.keys())
+    @property
+    def lightsources(self):
+        """sorted list of light source names"""
+        return sorted(self._spectralLines.keys())
+
+    def __len__(self):
+        return len(self._data)
+    def __iter__(self):
+        for k in self.instruments:
+            yield self._data[k]
+    def __getitem__(self, key):
+        """the CalibrateData object for a (serial number, direction) pair"""
+        return self._data[key]
+
+    def _getData(self, serialNumber, direction):
+        key = (serialNumber, direction)
+        if key not in self._data:
+            data = CalibrateData(serialNumber, direction)
+            if self._minIntensity is not None:
+                data.minIntensity = self._minIntensity
+            data.centroidMethod = self._centroidMethod
+            data.combineMethod = self._combineMethod
+            for name in self._spectralLines:
+                data.addLightSource(name, self._spectralLines[name])
+            self._data[key] = data
+        return self._data[key]
+
+    def addLightSource(self, name, spectralLines):
+        """
+        add a new light source
+
+        Parameters
+        ----------
+        name - the name of the light source
+        spectralLines - name of the file containing the spectral lines
+        """
+        if name in self._spectralLines:
+            raise RuntimeError('light source %s is already loaded'%name)
+        self._spectralLines[name] = spectralLines
+        self._classifier.addLightSource(name, spectralLines)
+        for data in self._data.values():
+            data.addLightSource(name, spectralLines)
+
+    def addSpectrum(self, lightSource, piccoFile):
+        """
+        parse a piccolo file and add its spectra
+
+        Parameters
+        ----------
+        lightSource - the name of the light source used to collect the spectra,
+                      None to identify the light source of each spectrum
+        piccoFile - the name of the piccolo file to be loaded
+        """
+        if lightSource is not None and lightSource not in self._spectralLines:
+            raise RuntimeError('light source %s not registered'%lightSource)
+
+        with open(piccoFile,'r') as inFile:
+            spectra = PiccoloSpectraList(data=inFile.read())
+
+        for s in spectra:
+            sn = s['SerialNumber']
+            dr = s['Direction']
+            if self._serialNumber is not None and sn != self._serialNumber:
+                continue
+            if self._direction is not None and dr != self._direction:
+                continue
+            ls = lightSource
+            if ls is None:
+                ls = self._identify(s)
+                if ls is None:
+                    logging.getLogger("piccolo.calibrate").warning('could not identify light source of spectrum in %s'%piccoFile)
+                    continue
+            data = self._getData(sn, dr)
+            first = data.numSpectra == 0
+            data.addPiccoloSpectrum(ls, s, piccoFile, findPeaks=False)
+            if first and self._saturationPercentage is not None:
+                data.saturationPercentage = self._saturationPercentage
+
+    def _identify(self, spectrum):
+        keywords = {}
+        if self._minIntensity is not None:
+            keywords['minIntensity'] = self._minIntensity
+        if self._saturationPercentage is not None:
+            keywords['saturationPercentage'] = self._saturationPercentage
+        return self._classifier.identifySpectrum(spectrum, **keywords)
+
+    def calibrate(self, jobs=None, **keywords):
+        """find peaks, match them to spectral lines and fit the wavelengths
+
+        The instruments are processed in parallel.
+
+        Parameters
+        ----------
+        jobs: the number of worker processes, default: number of CPUs,
+              use 1 to process the instruments in the current process
+        keywords: passed on to CalibrateData.fitWavelength
+        """
+        keys = self.instruments
+        if jobs == 1 or len(keys) < 2:
+            for k in keys:
+                _calibrate(self._data[k], keywords)
+            return
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(_calibrate, self._data[k], keywords) for k in keys]
+            for k,f in zip(keys,futures):
+                self._data[k] = f.result()
@@ -0,0 +1,87 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ['ChunkedNetCDFWriter','iter_chunks']
+
+import numpy
+import netCDF4
+
+# encoding used for time variables so that all chunks use the same units
+TIME_ENCODING = {'units': 'microseconds since 1970-01-01', 'dtype': 'int64'}
+
+def iter_chunks(ds, chunkSize=1000, dim='measurement'):
+    """iterate over a dataset in chunks along a dimension
+
+    Parameters
+    ----------
+    ds: the xarray dataset, when backed by a file only a chunk is loaded at a time
+    chunkSize: the number of entries along dim per chunk
+    dim: the dimension to split
+    """
+    for i in range(0, ds.sizes[dim], chunkSize):
+        yield ds.isel({dim: slice(i, i+chunkSize)}).load()
+
+class ChunkedNetCDFWriter(object):
+    """write an xarray dataset to a netCDF file one chunk at a time
+
+    The first chunk defines the structure of the file, the variables of
+    subsequent chunks that depend on the unlimited dimension are appended
+    to the file. All other variables are only written with the first chunk.
+    """
+
+    def __init__(self, fname, dim='measurement'):
+        """
+        Parameters
+        ----------
+        fname: the name of the output file
+        dim: the dimension along which chunks are appended
+        """
+        self._fname = fname
+        self._dim = dim
+        self._size = None
+
+    @property
+    def size(self):
+        """the number of entries along the unlimited dimension written so far"""
+        return 0 if self._size is None else self._size
+
+    def write(self, ds):
+        """append a chunk of data"""
+        if self._size is None:
+            encoding = {}
+            for name,var in ds.variables.items():
+                if var.dtype.kind == 'M':
+                    encoding[name] = dict(TIME_ENCODING)
+            ds.to_netcdf(self._fname, engine='netcdf4', unlimited_dims=[self._dim],
+                         encoding=encoding)
+            self._size = ds.sizes[self._dim]
+            return
+
+        n = ds.sizes[self._dim]
+        with netCDF4.Dataset(self._fname, 'a') as nc:
+            for name,var in ds.variables.items():
+                if self._dim not in var.dims:
+                    continue
+                values = var.values
+                if values.dtype.kind == 'M':
+                    values = values.astype('datetime64[us]').astype(numpy.int64)
+                elif values.dtype.kind == 'U':
+                    values = values.astype(object)
+                index = [slice(None)]*var.ndim
+                index[var.dims.index(self._dim)] = slice(self._size, self._size+n)
+                nc.variables[name][tuple(index)] = values
+        self._size += n
@@ -0,0 +1,66 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ['COMBINE_METHODS','combine_spectra']
+
+import numpy
+import warnings
+
+COMBINE_METHODS = ['mean','median']
+
+def combine_spectra(spectra, saturation=None, method='mean'):
+    """combine a stack of spectra into a single spectrum
+
+    The spectra are co-added (averaged) or median combined pixel by pixel.
+    Saturated pixels are excluded. A pixel that is saturated in all spectra
+    is set to the saturation level.
+
+    Parameters
+    ----------
+    spectra: 2D array of spectra, one spectrum per row
+    saturation: the saturation level, pixels at or above it are ignored
+    method: mean - the average of the spectra
+            median - the median of the spectra
+
+    Returns
+    -------
+    the combined spectrum
+    """
+    spectra = numpy.asarray(spectra, dtype=float)
+    if spectra.ndim == 1:
+        spectra = spectra[None,:]
+    if method not in COMBINE_METHODS:
+        raise ValueError('unknown combine method %s'%method)
+    if spectra.shape[0] == 0:
+        raise ValueError('no spectra to combine')
+
+    if saturation is None:
+        valid = numpy.ones(spectra.shape, dtype=bool)
+    else:
+        valid = spectra < saturation
+    if method == 'mean':
+        n = numpy.sum(valid, axis=0)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            combined = numpy.sum(numpy.where(valid, spectra, 0.), axis=0)/n
+    else:
+        with warnings.catch_warnings():
+            # pixels saturated in all spectra are handled below
+            warnings.simplefilter('ignore', RuntimeWarning)
+            combined = numpy.nanmedian(numpy.where(valid, spectra, numpy.nan), axis=0)
+    if saturation is not None:
+        combined[~numpy.any(valid, axis=0)] = saturation
+    return combined
@@ -0,0 +1,219 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ['DarkStatistics']
+
+import numpy
+import xarray
+import logging
+import os.path
+from pathlib import Path
+from piccolo3.common import PiccoloSpectraList
+from .spectraStatistics import SpectraStatistics
+
+class DarkStatistics(object):
+    """streaming per pixel statistics of the dark spectra of each instrument
+
+    The dark spectra, normalised by integration time, are accumulated for
+    each serial number and direction in a single pass using Welford's
+    algorithm. The statistics are stored together with the names of the
+    processed files so that they can be updated when new files arrive.
+
+    All pixels of the dark spectra, taken with the shutter closed, are used
+    to find hot and dead pixels. This differs from dispdark's plots which
+    use the optically masked dark_pixels that are part of every spectrum.
+    """
+
+    # the number of spectra buffered before they are added to the statistics
+    BLOCK_SIZE = 1000
+
+    def __init__(self, hotThreshold=5., deadThreshold=0.01):
+        """
+        Parameters
+        ----------
+        hotThreshold: pixels whose mean exceeds the median of all pixels by
+                      more than hotThreshold times the scaled median absolute
+                      deviation are hot
+        deadThreshold: pixels whose standard deviation is below deadThreshold
+                       times the median standard deviation of all pixels are dead
+        """
+        self._hotThreshold = hotThreshold
+        self._deadThreshold = deadThreshold
+        self._stats = {}
+        self._files = {}
+        self._processed = set()
+        self._buffer = {}
+
+    @property
+    def instruments(self):
+        """sorted list of (serial number, direction) pairs"""
+        return sorted(set(self._stats.keys()) | set(self._buffer.keys()))
+
+    def files(self, serialNumber, direction):
+        """the set of files processed for an instrument"""
+        return self._files.get((serialNumber, direction), set())
+
+    @property
+    def processedFiles(self):
+        """the set of all files processed, including files without dark spectra"""
+        return self._processed
+
+    def addSpectrum(self, spectrum):
+        """add a dark spectrum, light spectra are ignored
+
+        Returns
+        -------
+        True if the spectrum was added
+        """
+        if not spectrum['Dark']:
+            return False
+        key = (spectrum['SerialNumber'], spectrum['Direction'])
+        self._buffer.setdefault(key, []).append(numpy.asarray(spectrum.pixels, dtype=float)/spectrum['IntegrationTime'])
+        if len(self._buffer[key]) >= self.BLOCK_SIZE:
+            self._flush(key)
+        return True
+
+    def addFile(self, fname):
+        """add the dark spectra of a piccolo file unless it was processed before
+
+        Returns
+        -------
+        the number of dark spectra added
+        """
+        fname = os.path.abspath(fname)
+        # the dark spectra of all instruments are added when a file is
+        # processed, so it can be skipped without parsing it
+        if fname in self._processed:
+            return 0
+        spectra = PiccoloSpectraList(data=open(fname, 'r').read())
+        self._processed.add(fname)
+        n = 0
+        added = set()
+        for s in spectra:
+            key = (s['SerialNumber'], s['Direction'])
+            if self.addSpectrum(s):
+                added.add(key)
+                n += 1
+        for key in added:
+            self._files.setdefault(key, set()).add(fname)
+        return n
+
+    def _flush(self, key=None):
+        if key is None:
+            keys = list(self._buffer.keys())
+        else:
+            keys = [key]
+        for k in keys:
+            if len(self._buffer.get(k, [])) == 0:
+                continue
+            if k not in self._stats:
+                self._stats[k] = SpectraStatistics()
+            self._stats[k].update(numpy.array(self._buffer[k]))
+            self._buffer[k] = []
+
+    def statistics(self, serialNumber, direction):
+        """the SpectraStatistics object of an instrument"""
+        key = (serialNumber, direction)
+        self._flush(key)
+        return self._stats[key]
+
+    def mask(self, serialNumber, direction):
+        """the hot and dead pixels of an instrument
+
+        Returns
+        -------
+        boolean arrays of hot pixels and of dead pixels
+        """
+        stats = self.statistics(serialNumber, direction)
+        mean = stats.mean
+        std = stats.std
+        with numpy.errstate(invalid='ignore'):
+            median = numpy.nanmedian(mean)
+            mad = 1.4826*numpy.nanmedian(numpy.abs(mean-median))
+            hot = mean > median+self._hotThreshold*mad
+            dead = (stats.count == 0) | (std <= self._deadThreshold*numpy.nanmedian(std))
+        return hot, dead
+
+    def dataset(self, serialNumber, direction):
+        """the statistics of an instrument as an xarray dataset"""
+        stats = self.statistics(serialNumber, direction)
+        hot, dead = self.mask(serialNumber, direction)
+        files = sorted(self.files(serialNumber, direction))
+        ds = xarray.Dataset({'count' : (['pixel'], stats.count),
+                             'mean' : (['pixel'], stats.mean),
+                             'std' : (['pixel'], stats.std),
+                             'm2' : (['pixel'], stats.m2),
+                             'hot' : (['pixel'], hot.astype(numpy.int8)),
+                             'dead' : (['pixel'], dead.astype(numpy.int8)),
+                             'files' : (['file'], numpy.array(files, dtype=str))},
+                            coords={'pixel' : numpy.arange(len(stats.count))})
+        ds.attrs['serial'] = serialNumber
+        ds.attrs['direction'] = direction
+        ds.attrs['number_of_spectra'] = stats.numSpectra
+        ds.attrs['hot_threshold'] = self._hotThreshold
+        ds.attrs['dead_threshold'] = self._deadThreshold
+        ds['mean'].attrs['units'] = 'counts per unit integration time'
+        return ds
+
+    def load(self, fname):
+        """restore the statistics of an instrument from a file written by write"""
+        with xarray.open_dataset(fname) as ds:
+            ds.load()
+        key = (ds.attrs['serial'], ds.attrs['direction'])
+        if key in self._stats or key in self._buffer:
+            raise RuntimeError('statistics of %s %s already loaded'%key)
+        self._stats[key] = SpectraStatistics.fromMoments(ds['count'].values, ds['mean'].fillna(0).values,
+                                                         ds['m2'].values, numSpectra=int(ds.attrs['number_of_spectra']))
+        self._files[key] = set(str(f) for f in ds['files'].values)
+        self._processed.update(self._files[key])
+        return key
+
+    def fileName(self, outdir, serialNumber, direction):
+        """the name of the file of an instrument in directory outdir"""
+        return Path(outdir).joinpath('%s_%s_dark.nc'%(serialNumber, direction))
+
+    def processedFileName(self, outdir):
+        """the name of the file listing all processed files in directory outdir"""
+        return Path(outdir).joinpath('processed_files.nc')
+
+    def loadDirectory(self, outdir):
+        """restore the statistics of all instruments and the processed files from directory outdir"""
+        fname = self.processedFileName(outdir)
+        if fname.exists():
+            with xarray.open_dataset(fname) as ds:
+                self._processed.update(str(f) for f in ds['files'].values)
+        return [self.load(f) for f in sorted(Path(outdir).glob('*_dark.nc'))]
+
+    def write(self, outdir):
+        """write the statistics of each instrument to directory outdir
+
+        Returns
+        -------
+        list of the names of the files written
+        """
+        log = logging.getLogger("piccolo.dark")
+        names = []
+        for key in self.instruments:
+            fname = self.fileName(outdir, *key)
+            log.info('writing %s'%fname)
+            self.dataset(*key).to_netcdf(fname)
+            names.append(fname)
+        # files without dark spectra are only recorded here
+        fname = self.processedFileName(outdir)
+        xarray.Dataset({'files' : (['file'], numpy.array(sorted(self._processed), dtype=str))}).to_netcdf(fname)
+        names.append(fname)
+        return names
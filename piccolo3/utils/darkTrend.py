@@ -0,0 +1,217 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ['DARK_TREND_TERMS','DarkTrend']
+
+import numpy
+import xarray
+import datetime
+from piccolo3.common import PiccoloSpectraList
+
+# the explanatory variables of the dark model, an intercept is always included
+DARK_TREND_TERMS = ['temperature','integration_time','temperature_integration_time','time']
+
+# times are measured in days since this epoch
+EPOCH = datetime.datetime(2020,1,1,tzinfo=datetime.timezone.utc)
+
+class DarkTrend(object):
+    """per pixel regression of the dark counts against explanatory variables
+
+    For each serial number and direction the dark counts of every pixel are
+    modelled as a linear function of detector temperature, integration
+    time, their product and time. Only the normal equations are
+    accumulated, so the memory required does not depend on the number of
+    spectra and partial results can be merged.
+    """
+
+    # the number of spectra buffered before they are added to the normal equations
+    BLOCK_SIZE = 1000
+
+    def __init__(self, terms=DARK_TREND_TERMS):
+        """
+        Parameters
+        ----------
+        terms: the explanatory variables, a subset of DARK_TREND_TERMS
+        """
+        for t in terms:
+            if t not in DARK_TREND_TERMS:
+                raise ValueError('unknown term %s'%t)
+        self._terms = list(terms)
+        # per instrument: number of spectra, X^T X, X^T Y and sum of Y^2
+        self._sums = {}
+        self._buffer = {}
+        self._skipped = 0
+
+    @property
+    def terms(self):
+        """the names of the model coefficients"""
+        return ['intercept']+self._terms
+    @property
+    def instruments(self):
+        """sorted list of (serial number, direction) pairs"""
+        return sorted(set(self._sums.keys()) | set(self._buffer.keys()))
+    @property
+    def skipped(self):
+        """the number of dark spectra skipped because the temperature is missing"""
+        return self._skipped
+
+    def count(self, serialNumber, direction):
+        """the number of spectra of an instrument"""
+        self._flush((serialNumber, direction))
+        return self._sums[(serialNumber, direction)][0]
+
+    def _row(self, temperature, integrationTime, time):
+        values = {'temperature' : temperature,
+                  'integration_time' : integrationTime,
+                  'temperature_integration_time' : temperature*integrationTime,
+                  'time' : time}
+        return [1.]+[values[t] for t in self._terms]
+
+    def addSpectrum(self, spectrum):
+        """add a dark spectrum, light spectra are ignored
+
+        Returns
+        -------
+        True if the spectrum was added
+        """
+        if not spectrum['Dark']:
+            return False
+        if 'TemperatureDetectorActual' not in spectrum.keys() or spectrum['TemperatureDetectorActual'] is None:
+            self._skipped += 1
+            return False
+        t = datetime.datetime.strptime(spectrum['Datetime'], '%Y-%m-%dT%H:%M:%S.%f%z')
+        days = (t-EPOCH).total_seconds()/86400.
+        key = (spectrum['SerialNumber'], spectrum['Direction'])
+        self._buffer.setdefault(key, []).append(
+            (self._row(spectrum['TemperatureDetectorActual'], spectrum['IntegrationTime'], days),
+             numpy.asarray(spectrum.pixels, dtype=float)))
+        if len(self._buffer[key]) >= self.BLOCK_SIZE:
+            self._flush(key)
+        return True
+
+    def addFile(self, fname):
+        """add the dark spectra of a piccolo file
+
+        Returns
+        -------
+        the number of dark spectra added
+        """
+        spectra = PiccoloSpectraList(data=open(fname, 'r').read())
+        return sum(self.addSpectrum(s) for s in spectra)
+
+    def _add(self, key, n, xtx, xty, yty):
+        if key not in self._sums:
+            self._sums[key] = [n, xtx, xty, yty]
+        else:
+            s = self._sums[key]
+            if s[2].shape != xty.shape:
+                raise ValueError('expected %d pixels for %s %s, got %d'%((s[2].shape[1],)+key+(xty.shape[1],)))
+            s[0] += n
+            s[1] = s[1]+xtx
+            s[2] = s[2]+xty
+            s[3] = s[3]+yty
+
+    def _flush(self, key=None):
+        if key is None:
+            keys = list(self._buffer.keys())
+        else:
+            keys = [key]
+        for k in keys:
+            if len(self._buffer.get(k, [])) == 0:
+                continue
+            x = numpy.array([b[0] for b in self._buffer[k]])
+            y = numpy.array([b[1] for b in self._buffer[k]])
+            self._buffer[k] = []
+            self._add(k, len(x), x.T@x, x.T@y, numpy.sum(y**2, axis=0))
+
+    def merge(self, other):
+        """add the normal equations accumulated by another DarkTrend object"""
+        if other.terms != self.terms:
+            raise ValueError('cannot merge dark trends with different terms')
+        other._flush()
+        for k in other._sums:
+            n, xtx, xty, yty = other._sums[k]
+            self._add(k, n, xtx, xty, yty)
+        self._skipped += other._skipped
+
+    def fit(self, serialNumber, direction):
+        """fit the model of an instrument
+
+        The coefficients of all pixels are obtained by solving the normal
+        equations once. The explanatory variables are centred on their means
+        which are stored as attributes, the intercept is the dark at the mean
+        conditions.
+
+        Returns
+        -------
+        xarray dataset containing the coefficients, their standard errors and
+        the residual standard deviation of each pixel; when time is a term the
+        drift in counts per day and the number of days after which the drift
+        exceeds the residual standard deviation
+        """
+        key = (serialNumber, direction)
+        self._flush(key)
+        n, xtx, xty, yty = self._sums[key]
+        p = xtx.shape[0]
+
+        # centre the explanatory variables: X' = X A
+        means = xtx[0,1:]/n
+        a = numpy.eye(p)
+        a[0,1:] = -means
+        xtx = a.T@xtx@a
+        xty = a.T@xty
+
+        # scale the columns to improve the conditioning and solve for all
+        # pixels at once, rank deficient designs get the minimum norm solution
+        scale = numpy.sqrt(numpy.diag(xtx))
+        scale[scale == 0] = 1.
+        xtxs = xtx/numpy.outer(scale, scale)
+        inv = numpy.linalg.pinv(xtxs)
+        coeffs = (inv@(xty/scale[:,None]))/scale[:,None]
+        rank = numpy.linalg.matrix_rank(xtxs)
+
+        rss = yty-numpy.sum(coeffs*xty, axis=0)
+        dof = n-rank
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            sigma2 = numpy.where(dof > 0, numpy.maximum(rss, 0.)/dof, numpy.nan)
+            stderr = numpy.sqrt(numpy.outer(numpy.diag(inv)/scale**2, sigma2))
+
+        nPixels = xty.shape[1]
+        ds = xarray.Dataset({'coefficients' : (['term','pixel'], coeffs),
+                             'stderr' : (['term','pixel'], stderr),
+                             'residual_std' : (['pixel'], numpy.sqrt(sigma2))},
+                            coords={'term' : self.terms,
+                                    'pixel' : numpy.arange(nPixels)})
+        if 'time' in self._terms:
+            drift = coeffs[self.terms.index('time')]
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                cadence = numpy.sqrt(sigma2)/numpy.abs(drift)
+            ds['drift'] = (['pixel'], drift)
+            ds['drift'].attrs['units'] = 'counts per day'
+            ds['cadence'] = (['pixel'], cadence)
+            ds['cadence'].attrs['units'] = 'days'
+            ds['cadence'].attrs['description'] = 'time after which the drift exceeds the residual standard deviation'
+            ds.attrs['median_drift'] = float(numpy.nanmedian(drift))
+            ds.attrs['median_cadence'] = float(numpy.nanmedian(cadence))
+        ds.attrs['serial'] = serialNumber
+        ds.attrs['direction'] = direction
+        ds.attrs['number_of_spectra'] = int(n)
+        ds.attrs['rank'] = int(rank)
+        ds.attrs['time_epoch'] = EPOCH.isoformat()
+        for t,m in zip(self._terms, means):
+            ds.attrs['mean_'+t] = float(m)
+        return ds
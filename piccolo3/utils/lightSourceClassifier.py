@@ -0,0 +1,153 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ['LightSourceClassifier']
+
+import numpy
+from scipy.signal import find_peaks
+from .matchSpectralLines import PiccoloSpectralLines
+
+class LightSourceClassifier(object):
+    """identify the light source of a spectrum from its spectral lines
+
+    The peaks of a spectrum are converted to wavelengths using the original
+    wavelength coefficients and compared with the line library of each
+    light source. The score of a light source is the fraction of peaks that
+    lie close to one of its lines less the fraction expected by chance.
+    """
+
+    def __init__(self, maxDist=2., minScore=0.2):
+        """
+        Parameters
+        ----------
+        maxDist: the maximum distance between a peak and a line
+        minScore: the minimum score required to identify a light source
+        """
+        self._maxDist = maxDist
+        self._minScore = minScore
+        self._spectralLines = {}
+        self._lines = None
+
+    @property
+    def lightsources(self):
+        """sorted list of light source names"""
+        return sorted(self._spectralLines.keys())
+
+    def addLightSource(self, name, spectralLines):
+        """
+        add a line library
+
+        Parameters
+        ----------
+        name - the name of the light source
+        spectralLines - name of the file containing the spectral lines or a
+                        PiccoloSpectralLines object
+        """
+        if name in self._spectralLines:
+            raise RuntimeError('light source %s is already loaded'%name)
+        if not isinstance(spectralLines, PiccoloSpectralLines):
+            spectralLines = PiccoloSpectralLines(spectralLines)
+        self._spectralLines[name] = spectralLines
+        self._lines = None
+
+    def _libraries(self):
+        """all lines in a single sorted array, the lines of each library are offset"""
+        if self._lines is None:
+            lines = [self._spectralLines[l].wavelengths for l in self.lightsources]
+            label = numpy.repeat(numpy.arange(len(lines)), [len(l) for l in lines])
+            lines = numpy.concatenate(lines) if len(lines) > 0 else numpy.zeros(0)
+            # shift each library well clear of the previous one
+            self._offset = 2*(numpy.abs(lines).max(initial=0)+self._maxDist)+1
+            self._lines = (lines+label*self._offset, label)
+        return self._lines
+
+    def score(self, wavelengths, wavelengthRange=None):
+        """score each light source
+
+        Parameters
+        ----------
+        wavelengths: the wavelengths of the peaks
+        wavelengthRange: the (min, max) wavelength of the spectrometer used to
+                         estimate the chance of a peak matching a line,
+                         default: the range of the peaks
+
+        Returns
+        -------
+        array of scores in the order of lightsources
+        """
+        wavelengths = numpy.asarray(wavelengths, dtype=float)
+        nLib = len(self._spectralLines)
+        if len(wavelengths) == 0 or nLib == 0:
+            return numpy.zeros(nLib)
+        if wavelengthRange is None:
+            wavelengthRange = (wavelengths.min(), wavelengths.max())
+        lines, label = self._libraries()
+
+        # nearest line of each library for every peak in a single search
+        lib = numpy.arange(nLib)
+        query = (wavelengths[None,:]+lib[:,None]*self._offset).ravel()
+        qlib = numpy.repeat(lib, len(wavelengths))
+        dist = numpy.full(len(query), numpy.inf)
+        idx = numpy.searchsorted(lines, query)
+        for neighbour in [idx-1, idx]:
+            ok = (neighbour >= 0) & (neighbour < len(lines))
+            ok[ok] = label[neighbour[ok]] == qlib[ok]
+            dist[ok] = numpy.minimum(dist[ok], numpy.abs(lines[neighbour[ok]]-query[ok]))
+        hits = (dist <= self._maxDist).reshape(nLib, len(wavelengths))
+
+        # the fraction of the wavelength range covered by the lines
+        wmin, wmax = wavelengthRange
+        chance = numpy.zeros(nLib)
+        if wmax > wmin:
+            for i, l in enumerate(self.lightsources):
+                w = self._spectralLines[l].wavelengths
+                w = w[(w >= wmin-self._maxDist) & (w <= wmax+self._maxDist)]
+                if len(w) > 0:
+                    covered = 2*self._maxDist+numpy.sum(numpy.minimum(numpy.diff(w), 2*self._maxDist))
+                    chance[i] = min(covered/(wmax-wmin), 1.)
+        return hits.mean(axis=1)-chance
+
+    def identify(self, wavelengths, wavelengthRange=None):
+        """the name of the best matching light source, None if no light source matches"""
+        if len(self._spectralLines) == 0:
+            return None
+        s = self.score(wavelengths, wavelengthRange=wavelengthRange)
+        best = numpy.argmax(s)
+        if s[best] < self._minScore:
+            return None
+        return self.lightsources[best]
+
+    def identifySpectrum(self, spectrum, minIntensity=5000, saturationPercentage=80):
+        """
+        identify the light source of a piccolo spectrum
+
+        Parameters
+        ----------
+        spectrum - the piccolo spectrum
+        minIntensity - the minimum intensity considered for finding peaks
+        saturationPercentage - the maximum intensity considered for finding
+                               peaks as a percentage of the saturation level
+
+        Returns
+        -------
+        the name of the light source, None if no light source matches
+        """
+        pixels = numpy.asarray(spectrum.pixels, dtype=float)
+        height = [minIntensity, 0.01*saturationPercentage*spectrum['SaturationLevel']]
+        peaks,_ = find_peaks(pixels, height=height)
+        poly = numpy.poly1d(spectrum['WavelengthCalibrationCoefficients'][::-1])
+        return self.identify(poly(peaks), wavelengthRange=tuple(poly([0, len(pixels)-1])))
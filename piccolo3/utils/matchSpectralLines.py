@@ -17,8 +17,9 @@
 
 __all__  = ['PiccoloSpectralLines']
 
-from piccolo3.common import PiccoloSpectrum
 import numpy
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
 
 class PiccoloSpectralLines(object):
 
@@ -26,22 +27,78 @@ class PiccoloSpectralLines(object):
         """
         load spectral lines from csv file fname
         """
-        self._spectraLines = numpy.loadtxt(fname)
+        self._spectraLines = numpy.sort(numpy.atleast_1d(numpy.loadtxt(fname)))
 
     @property
     def lines(self):
         for l in self._spectraLines:
             yield l
 
+    @property
+    def wavelengths(self):
+        """sorted array of the wavelengths of the spectral lines"""
+        return self._spectraLines
+
     def match(self,peaks,maxDist=2.):
-        matched = []
-        lines = list(self._spectraLines)
-        lines.sort()
-
-        for p,w in peaks:
-            for j in range(len(lines)):
-                if abs(w-lines[j]) < maxDist:
-                    matched.append((p,lines[j]))
-                    del lines[j]
-                    break
-        return matched
+        """match peaks to spectral lines
+
+        Each peak is matched to at most one line and each line to at most
+        one peak. The assignment maximises the number of matches and amongst
+        those minimises the total distance between peaks and lines.
+
+        Parameters
+        ----------
+        peaks: sequence of (pixel, wavelength) pairs
+        maxDist: the maximum distance between a peak and a line
+
+        Returns
+        -------
+        list of (pixel, line wavelength) pairs
+        """
+        peaks = list(peaks)
+        if len(peaks) == 0 or len(self._spectraLines) == 0:
+            return []
+        pixels,w = numpy.array(peaks,dtype=float).T
+        if numpy.all(pixels == numpy.round(pixels)):
+            pixels = pixels.astype(int)
+        order = numpy.argsort(w,kind='stable')
+        w = w[order]
+        lines = self._spectraLines
+
+        # the candidate lines of each peak form a contiguous range
+        lo = numpy.searchsorted(lines,w-maxDist,side='right')
+        hi = numpy.searchsorted(lines,w+maxDist,side='left')
+        counts = hi-lo
+        if counts.sum() == 0:
+            return []
+
+        # build a sparse bipartite graph of peaks and candidate lines; each
+        # peak is also connected to its own dummy line so that a full matching
+        # always exists, a peak matched to its dummy line is not matched
+        nPeaks = len(w)
+        nCandidates = counts+1
+        indptr = numpy.zeros(nPeaks+1,dtype=int)
+        indptr[1:] = numpy.cumsum(nCandidates)
+        rows = numpy.repeat(numpy.arange(nPeaks),nCandidates)
+        cols = numpy.arange(indptr[-1])-indptr[rows]+lo[rows]
+        dummy = numpy.zeros(indptr[-1],dtype=bool)
+        dummy[indptr[1:]-1] = True
+        # only lines that are candidates of some peak take part
+        candidates = numpy.unique(cols[~dummy])
+        nLines = len(candidates)
+        cols[~dummy] = numpy.searchsorted(candidates,cols[~dummy])
+        cols[dummy] = nLines+numpy.arange(nPeaks)
+        # the weights are shifted by one as the solver ignores zero weights,
+        # this does not change the optimal matching since every peak is matched
+        # exactly once; unmatched peaks are penalised such that the number of
+        # matches is maximised first
+        weights = numpy.empty(indptr[-1])
+        weights[~dummy] = 1.+numpy.abs(w[rows[~dummy]]-lines[candidates[cols[~dummy]]])
+        weights[dummy] = 2.+2*maxDist*nPeaks
+        graph = csr_matrix((weights,cols,indptr),shape=(nPeaks,nLines+nPeaks))
+
+        rows,cols = min_weight_full_bipartite_matching(graph)
+        ok = cols < nLines
+        matched = zip(rows[ok],candidates[cols[ok]])
+
+        return [(pixels[order[i]],lines[j]) for i,j in sorted(matched)]
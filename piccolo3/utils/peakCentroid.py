@@ -0,0 +1,75 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ['CENTROID_METHODS','refine_peaks']
+
+import numpy
+
+CENTROID_METHODS = ['parabolic','gaussian','centroid']
+
+def refine_peaks(spectra, rows, pixels, method='parabolic', halfWidth=2):
+    """refine the positions of peaks to sub-pixel accuracy
+
+    The windows around all peaks of all spectra are extracted into a single
+    2D array and the centres are computed in one vectorised pass.
+
+    Parameters
+    ----------
+    spectra: 2D array of spectra, one spectrum per row
+    rows: the row of each peak
+    pixels: the integer pixel of each peak
+    method: parabolic - fit a parabola through the peak and its neighbours
+            gaussian - fit a parabola to the logarithm of the intensities,
+                       exact for Gaussian line shapes
+            centroid - centre of mass of the window above the window minimum
+    halfWidth: the half width of the window used by the centroid method
+
+    Returns
+    -------
+    array of refined peak positions
+    """
+    spectra = numpy.asarray(spectra, dtype=float)
+    rows = numpy.asarray(rows, dtype=int)
+    pixels = numpy.asarray(pixels, dtype=int)
+    if method not in CENTROID_METHODS:
+        raise ValueError('unknown centroid method %s'%method)
+    if len(pixels) == 0:
+        return numpy.zeros(0)
+
+    if method == 'centroid':
+        hw = halfWidth
+    else:
+        hw = 1
+    nPixels = spectra.shape[1]
+    offsets = numpy.arange(-hw, hw+1)
+    idx = pixels[:,None]+offsets[None,:]
+    # windows extending beyond the edge of the detector are not refined
+    inside = (pixels-hw >= 0) & (pixels+hw < nPixels)
+    windows = spectra[rows[:,None], numpy.clip(idx, 0, nPixels-1)]
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        if method == 'centroid':
+            weights = windows-windows.min(axis=1)[:,None]
+            delta = numpy.sum(weights*offsets[None,:], axis=1)/numpy.sum(weights, axis=1)
+        else:
+            if method == 'gaussian':
+                windows = numpy.log(numpy.maximum(windows, numpy.finfo(float).tiny))
+            ym, y0, yp = windows.T
+            delta = 0.5*(ym-yp)/(ym-2*y0+yp)
+
+    ok = inside & numpy.isfinite(delta) & (numpy.abs(delta) <= hw)
+    return pixels + numpy.where(ok, delta, 0.)
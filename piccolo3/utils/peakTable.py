@@ -0,0 +1,230 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ['PeakTable']
+
+import numpy, pandas
+
+class PeakTable(object):
+    """table of peaks keyed by (fileID, lightSource, pixel)
+
+    The peaks are held in numpy arrays sorted by light source, pixel and
+    fileID. Peaks are inserted and wavelengths are updated in bulk. The
+    pandas dataframe is only constructed when it is requested.
+    """
+
+    def __init__(self):
+        self._lightSources = []
+        self._codes = {}
+
+        self._fileID = numpy.zeros(0,dtype=int)
+        self._source = numpy.zeros(0,dtype=int)
+        self._pixel = numpy.zeros(0,dtype=int)
+        self._position = numpy.zeros(0)
+        self._wavelength = numpy.zeros(0)
+        self._pending = []
+
+        self._frame = None
+
+    def __len__(self):
+        self._consolidate()
+        return len(self._pixel)
+
+    @property
+    def fileID(self):
+        """the file ID of each peak, -1 for peaks found in a combined spectrum"""
+        self._consolidate()
+        return self._fileID
+    @property
+    def pixel(self):
+        """the pixel of each peak"""
+        self._consolidate()
+        return self._pixel
+    @property
+    def position(self):
+        """the (sub-pixel) position of each peak"""
+        self._consolidate()
+        return self._position
+    @property
+    def wavelength(self):
+        """the wavelength of the spectral line matched to each peak, -1 if not matched"""
+        self._consolidate()
+        return self._wavelength
+    @property
+    def lightSource(self):
+        """the light source of each peak"""
+        self._consolidate()
+        return numpy.array(self._lightSources,dtype=object)[self._source]
+
+    @property
+    def frame(self):
+        """pandas dataframe of the peaks indexed by pixel"""
+        if self._frame is None:
+            self._consolidate()
+            order = numpy.lexsort((self._fileID,self._pixel))
+            lightSources = pandas.Categorical.from_codes(self._source[order],categories=self._lightSources) \
+                if len(self._lightSources) > 0 else []
+            self._frame = pandas.DataFrame({'fileID' : self._fileID[order],
+                                            'lightSource' : lightSources,
+                                            'position' : self._position[order],
+                                            'wavelength' : self._wavelength[order]},
+                                           index=pandas.Index(self._pixel[order],name='pixel'))
+        return self._frame
+
+    def _code(self, lightSource):
+        if lightSource not in self._codes:
+            self._codes[lightSource] = len(self._lightSources)
+            self._lightSources.append(lightSource)
+        return self._codes[lightSource]
+
+    def _consolidate(self):
+        if len(self._pending) == 0:
+            return
+        fileID, source, pixel, position = [numpy.concatenate([a]+[p[i] for p in self._pending])
+                                           for i,a in enumerate([self._fileID,self._source,self._pixel,self._position])]
+        wavelength = numpy.concatenate([self._wavelength,numpy.full(len(pixel)-len(self._wavelength),-1.)])
+        order = numpy.lexsort((fileID,pixel,source))
+        self._fileID = fileID[order]
+        self._source = source[order]
+        self._pixel = pixel[order]
+        self._position = position[order]
+        self._wavelength = wavelength[order]
+        self._pending = []
+
+    def add(self, fileID, lightSource, pixels, positions=None):
+        """add peaks
+
+        Parameters
+        ----------
+        fileID: the ID of the spectrum or an array with the ID of each peak
+        lightSource: the name of the light source
+        pixels: array of the pixels of the peaks
+        positions: array of the sub-pixel positions of the peaks, default: the pixels
+        """
+        pixels = numpy.asarray(pixels,dtype=int)
+        n = len(pixels)
+        if positions is None:
+            positions = pixels.astype(float)
+        self._pending.append((numpy.broadcast_to(numpy.asarray(fileID,dtype=int),(n,)),
+                              numpy.full(n,self._code(lightSource),dtype=int),
+                              pixels,
+                              numpy.asarray(positions,dtype=float)))
+        self._frame = None
+
+    def remove(self, lightSource):
+        """remove all peaks of a light source"""
+        if lightSource not in self._codes:
+            return
+        self._consolidate()
+        keep = self._source != self._codes[lightSource]
+        self._fileID = self._fileID[keep]
+        self._source = self._source[keep]
+        self._pixel = self._pixel[keep]
+        self._position = self._position[keep]
+        self._wavelength = self._wavelength[keep]
+        self._frame = None
+
+    def select(self, lightSource=None, matched=None):
+        """the indices of the peaks
+
+        Parameters
+        ----------
+        lightSource: only select peaks of this light source
+        matched: when True only select peaks matched to a spectral line, when
+                 False only select unmatched peaks
+        """
+        self._consolidate()
+        if lightSource is None:
+            idx = numpy.arange(len(self._pixel))
+        elif lightSource not in self._codes:
+            return numpy.zeros(0,dtype=int)
+        else:
+            # the peaks are sorted by light source
+            c = self._codes[lightSource]
+            idx = numpy.arange(numpy.searchsorted(self._source,c,side='left'),
+                               numpy.searchsorted(self._source,c,side='right'))
+        if matched is not None:
+            idx = idx[(self._wavelength[idx]>0) == matched]
+        return idx
+
+    def uniquePeaks(self, lightSource=None, matched=None):
+        """the pixels and wavelengths of the distinct peaks of a light source
+
+        The same peak found in several spectra is only returned once.
+
+        Returns
+        -------
+        sorted array of pixels and array of corresponding wavelengths
+        """
+        idx = self.select(lightSource=lightSource, matched=matched)
+        key = self._source[idx]*(self._pixel.max(initial=0)+1)+self._pixel[idx]
+        _,first = numpy.unique(key,return_index=True)
+        idx = idx[first]
+        order = numpy.argsort(self._pixel[idx],kind='stable')
+        idx = idx[order]
+        return self._pixel[idx], self._wavelength[idx]
+
+    def peakPositions(self, lightSource=None, matched=None):
+        """the positions and wavelengths of the distinct peaks of a light source
+
+        The positions of the same peak found in several spectra are averaged.
+
+        Returns
+        -------
+        sorted array of pixels, array of mean positions and array of wavelengths
+        """
+        idx = self.select(lightSource=lightSource, matched=matched)
+        key = self._source[idx]*(self._pixel.max(initial=0)+1)+self._pixel[idx]
+        _,first,inverse,counts = numpy.unique(key,return_index=True,return_inverse=True,return_counts=True)
+        positions = numpy.bincount(inverse.ravel(),weights=self._position[idx],minlength=len(first))/counts
+        idx = idx[first]
+        order = numpy.argsort(self._pixel[idx],kind='stable')
+        return self._pixel[idx[order]], positions[order], self._wavelength[idx[order]]
+
+    def setPositions(self, positions):
+        """set the sub-pixel positions of all peaks, in the order of the table"""
+        self._consolidate()
+        self._position = numpy.asarray(positions,dtype=float)
+        self._frame = None
+
+    def setWavelength(self, index, wavelengths):
+        """set the wavelengths of the peaks with the given indices"""
+        self._consolidate()
+        self._wavelength[index] = wavelengths
+        self._frame = None
+
+    def setWavelengthByPixel(self, lightSource, pixels, wavelengths):
+        """set the wavelengths of all peaks of a light source at the given pixels
+
+        Parameters
+        ----------
+        lightSource: the name of the light source
+        pixels: array of pixels
+        wavelengths: the wavelength for each pixel
+        """
+        idx = self.select(lightSource=lightSource)
+        pixels = numpy.atleast_1d(numpy.asarray(pixels,dtype=int))
+        if len(pixels) == 0 or len(idx) == 0:
+            return
+        wavelengths = numpy.broadcast_to(numpy.asarray(wavelengths,dtype=float),pixels.shape)
+        order = numpy.argsort(pixels)
+        pixels = pixels[order]
+        wavelengths = wavelengths[order]
+        pos = numpy.searchsorted(pixels,self._pixel[idx])
+        pos = numpy.minimum(pos,len(pixels)-1)
+        hit = pixels[pos] == self._pixel[idx]
+        self.setWavelength(idx[hit],wavelengths[pos[hit]])
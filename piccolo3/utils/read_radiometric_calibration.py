@@ -15,40 +15,129 @@
 # You should have received a copy of the GNU General Public License
 # along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
 
-__all__ = ['read_radiometric_calibration']
+__all__ = ['read_radiometric_calibration','evaluate_radiometric_calibration']
 
 import numpy
 from scipy import interpolate
+import hashlib
+import logging
+import os
+from .cache import cache_dir
 
 HEADER = ['description','units','some','start','end','step']
 HEADER_TYPE = [str,str,str,float,float,float]
 
-def read_radiometric_calibration(fname):
-    indata = open(fname,'r')
-    h = indata.readline().split(',')
+# parsed calibration files indexed by the hash of their content
+_calibrations = {}
+
+def _parse(content):
+    lines = content.decode().splitlines()
+    h = lines[0].split(',')
     caldata = {}
     assert len(HEADER) == len(h)
     for i in range(len(HEADER)):
         caldata[HEADER[i]] = HEADER_TYPE[i](h[i])
-    data = []
-    for d in indata.readlines():
-        data.append(float(d))
-    data = numpy.array(data)
+    data = numpy.array(' '.join(lines[1:]).split(), dtype=float)
 
     wavelengths = numpy.linspace(caldata['start'],caldata['end'],num=len(data))
 
     assert (abs(wavelengths[1]-wavelengths[0]-caldata['step']) < 1.e-6)
 
-    caldata['spline'] = interpolate.InterpolatedUnivariateSpline(wavelengths,data)
+    caldata['wavelengths'] = wavelengths
+    caldata['data'] = data
+    caldata['spline'] = interpolate.make_interp_spline(wavelengths,data,k=3)
+    return caldata
+
+def _cacheName(key):
+    d = cache_dir()
+    if d is None:
+        return None
+    return d.joinpath('radiometric_calibration_%s.npz'%key)
 
+def _load(name):
+    with numpy.load(name) as cached:
+        caldata = {}
+        for i in range(len(HEADER)):
+            caldata[HEADER[i]] = HEADER_TYPE[i](cached[HEADER[i]][()])
+        for k in ['wavelengths','data']:
+            caldata[k] = cached[k]
+        caldata['spline'] = interpolate.BSpline.construct_fast(cached['t'],cached['c'],int(cached['k']))
     return caldata
 
+def _store(name, caldata):
+    values = {}
+    for k in HEADER + ['wavelengths','data']:
+        values[k] = caldata[k]
+    spline = caldata['spline']
+    values.update({'t':spline.t, 'c':spline.c, 'k':spline.k})
+    # write to a temporary file first so that concurrent readers never see
+    # a partially written file
+    tmp = name.with_name('%s.%d.tmp.npz'%(name.stem,os.getpid()))
+    numpy.savez(tmp, **values)
+    os.replace(tmp, name)
+
+def read_radiometric_calibration(fname, cache=True):
+    """read a lamp/sphere calibration file
+
+    Parameters
+    ----------
+    fname: name of the calibration file
+    cache: when True, keep the parsed data and the spline in a binary file in the
+           cache directory keyed by the hash of the file content
+
+    Returns
+    -------
+    a dictionary containing the header fields, the wavelengths, the
+    calibration data and a spline interpolating the data
+    """
+    with open(fname,'rb') as indata:
+        content = indata.read()
+    key = hashlib.sha256(content).hexdigest()
+
+    if cache and key in _calibrations:
+        return dict(_calibrations[key])
+
+    name = _cacheName(key) if cache else None
+    caldata = None
+    if name is not None and name.exists():
+        try:
+            caldata = _load(name)
+        except Exception as e:
+            logging.getLogger("piccolo.calibration").warning('ignoring cache file %s: %s'%(name,e))
+    if caldata is None:
+        caldata = _parse(content)
+        if name is not None:
+            try:
+                _store(name, caldata)
+            except OSError as e:
+                logging.getLogger("piccolo.calibration").warning('cannot write cache file %s: %s'%(name,e))
+    if cache:
+        _calibrations[key] = caldata
+    return dict(caldata)
+
+def evaluate_radiometric_calibration(caldata, wavelengths):
+    """evaluate the calibration spline on a number of wavelength grids at once
+
+    Parameters
+    ----------
+    caldata: the calibration data returned by read_radiometric_calibration
+    wavelengths: a 2D array of wavelengths, one grid per row, or a list of
+                 wavelength arrays of possibly different length
+
+    Returns
+    -------
+    the calibration data interpolated to the wavelengths, either as 2D array
+    or list of arrays matching the input
+    """
+    if isinstance(wavelengths, numpy.ndarray):
+        return caldata['spline'](wavelengths.ravel()).reshape(wavelengths.shape)
+    grids = [numpy.asarray(w, dtype=float) for w in wavelengths]
+    values = caldata['spline'](numpy.concatenate(grids))
+    return numpy.split(values, numpy.cumsum([len(w) for w in grids])[:-1])
+
 if __name__ == '__main__':
     import sys
 
     cal = read_radiometric_calibration(sys.argv[1])
 
     print(cal)
-    
-
-    
@@ -0,0 +1,153 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ['pair_spectra','interpolation_weights','compute_reflectance']
+
+from .PiccoloProcessedData import spectra_types
+from .chunkedNetCDF import ChunkedNetCDFWriter, iter_chunks
+import numpy
+import pandas
+import logging
+
+def _index(ds):
+    return pandas.MultiIndex.from_arrays([ds.runs.values, ds.batches.values, ds.sequences.values],
+                                         names=['runs','batches','sequences'])
+
+def pair_spectra(upwelling, downwelling):
+    """match the upwelling to the downwelling spectra by run, batch and sequence number
+
+    The downwelling spectra are indexed by a hash table over (run, batch,
+    sequence) which is then looked up for all upwelling spectra at once.
+
+    Parameters
+    ----------
+    upwelling: xarray dataset containing the upwelling spectra
+    downwelling: xarray dataset containing the downwelling spectra
+
+    Returns
+    -------
+    array containing for each upwelling spectrum the index of the matching
+    downwelling spectrum or -1 if there is no match
+    """
+    down = _index(downwelling)
+    duplicated = down.duplicated()
+    if numpy.any(duplicated):
+        logging.getLogger("piccolo.reflectance").warning('ignoring %d duplicate downwelling spectra'%numpy.sum(duplicated))
+    positions = numpy.flatnonzero(~duplicated)
+    idx = down[~duplicated].get_indexer(_index(upwelling))
+    return numpy.where(idx>=0, positions[idx], -1)
+
+def interpolation_weights(source, target):
+    """the weights of linear interpolation from source onto target wavelengths
+
+    Parameters
+    ----------
+    source: the increasing wavelengths of the data
+    target: the wavelengths to interpolate to
+
+    Returns
+    -------
+    the index of the lower neighbour, its weight and a mask of the target
+    wavelengths that lie within the source range. The data are interpolated
+    with data[...,idx]*w + data[...,idx+1]*(1-w)
+    """
+    source = numpy.asarray(source, dtype=float)
+    target = numpy.asarray(target, dtype=float)
+    idx = numpy.clip(numpy.searchsorted(source, target, side='right')-1, 0, len(source)-2)
+    w = (source[idx+1]-target)/(source[idx+1]-source[idx])
+    inside = (target >= source[0]) & (target <= source[-1])
+    return idx, w, inside
+
+def compute_reflectance(upwelling, downwelling, output, chunkSize=1000):
+    """compute the reflectance factor of paired upwelling and downwelling spectra
+
+    Each upwelling spectrum is paired with the downwelling spectrum of the
+    same run, batch and sequence. Where the wavelengths of the two
+    spectrometers differ the downwelling spectra are linearly interpolated
+    onto the upwelling wavelengths. Upwelling spectra without a matching
+    downwelling spectrum are skipped. The reflectance factor pi*L/E is
+    computed for a chunk of pairs at a time and appended to the output file.
+
+    Parameters
+    ----------
+    upwelling: xarray dataset containing calibrated upwelling radiances
+    downwelling: xarray dataset containing calibrated downwelling irradiances
+    output: the name of the output netCDF file
+    chunkSize: the number of spectra processed at a time
+
+    Returns
+    -------
+    the number of pairs
+    """
+    log = logging.getLogger("piccolo.reflectance")
+    for ds,d in [(upwelling,'Upwelling'),(downwelling,'Downwelling')]:
+        if ds.spectra.attrs.get('description') != spectra_types[d]['description']:
+            raise RuntimeError('data for %s %s are not calibrated %s spectra'%(ds.attrs['serial'],ds.attrs['direction'],d.lower()))
+
+    match = pair_spectra(upwelling, downwelling)
+    numPairs = int(numpy.sum(match>=0))
+    if numPairs == 0:
+        raise RuntimeError('no matching spectra for %s and %s'%(upwelling.attrs['serial'],downwelling.attrs['serial']))
+    if numPairs < len(match):
+        log.warning('%d upwelling spectra of %s have no matching downwelling spectrum'%(len(match)-numPairs,upwelling.attrs['serial']))
+
+    wavelengths = upwelling.wavelengths.values
+    interpolate = downwelling.sizes['wavelengths'] != len(wavelengths) or \
+        not numpy.allclose(downwelling.wavelengths.values, wavelengths)
+    if interpolate:
+        log.info('interpolating downwelling spectra of %s onto wavelengths of %s'%(downwelling.attrs['serial'],upwelling.attrs['serial']))
+        idx, w, inside = interpolation_weights(downwelling.wavelengths.values, wavelengths)
+
+    attrs = dict(spectra_types['Reflectance'])
+    writer = ChunkedNetCDFWriter(output)
+    start = 0
+    for chunk in iter_chunks(upwelling, chunkSize=chunkSize):
+        m = match[start:start+chunk.sizes['measurement']]
+        start += chunk.sizes['measurement']
+        keep = m>=0
+        if not numpy.any(keep):
+            continue
+        chunk = chunk.isel(measurement=keep)
+        m = m[keep]
+
+        # load each required downwelling spectrum once, usually both
+        # datasets are in the same order and the rows form a contiguous block
+        # which is much faster to read than a scattered selection
+        rows, inverse = numpy.unique(m, return_inverse=True)
+        if rows[-1]-rows[0] < 2*len(rows):
+            down = downwelling.isel(measurement=slice(rows[0],rows[-1]+1)).load().isel(measurement=rows-rows[0])
+        else:
+            down = downwelling.isel(measurement=rows).load()
+        E = down.spectra.transpose('measurement','wavelengths').values
+        if interpolate:
+            E = numpy.where(inside, E[:,idx]*w + E[:,idx+1]*(1-w), numpy.nan)
+        E = E[inverse]
+
+        L = chunk.spectra.transpose('measurement','wavelengths').values
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            R = numpy.pi*L/E
+
+        result = chunk.drop_vars('spectra')
+        result['reflectance'] = (['measurement','wavelengths'], R, attrs)
+        result['time_downwelling'] = (['measurement'], down.time.values[inverse])
+        result.attrs = {'serial' : upwelling.attrs['serial'],
+                        'direction' : 'Reflectance',
+                        'upwelling_serial' : upwelling.attrs['serial'],
+                        'downwelling_serial' : downwelling.attrs['serial'],
+                        'downwelling_interpolated' : int(interpolate)}
+        writer.write(result)
+    return numPairs
@@ -0,0 +1,194 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ['RESAMPLE_METHODS','resampling_matrix','resample','resample_spectra']
+
+from .chunkedNetCDF import ChunkedNetCDFWriter, iter_chunks
+from .cache import cache_dir
+import numpy
+from scipy import sparse
+import hashlib
+import logging
+import os
+
+RESAMPLE_METHODS = ['linear','gaussian']
+
+# increase when the construction of the matrices changes to invalidate the cache
+CACHE_VERSION = 1
+
+# resampling matrices indexed by the hash of the wavelengths and method
+_matrices = {}
+
+def _linear(source, target, fwhm=None):
+    idx = numpy.clip(numpy.searchsorted(source, target, side='right')-1, 0, len(source)-2)
+    w = (source[idx+1]-target)/(source[idx+1]-source[idx])
+    inside = numpy.flatnonzero((target >= source[0]) & (target <= source[-1]))
+    rows = numpy.repeat(inside, 2)
+    cols = numpy.stack([idx[inside], idx[inside]+1], axis=1).ravel()
+    weights = numpy.stack([w[inside], 1-w[inside]], axis=1).ravel()
+    return rows, cols, weights
+
+def _gaussian(source, target, fwhm, truncate=3.):
+    sigma = fwhm/(2*numpy.sqrt(2*numpy.log(2)))
+    inside = numpy.flatnonzero((target >= source[0]) & (target <= source[-1]))
+    lo = numpy.searchsorted(source, target[inside]-truncate*sigma, side='left')
+    hi = numpy.searchsorted(source, target[inside]+truncate*sigma, side='right')
+    n = hi-lo
+    rows = numpy.repeat(inside, n)
+    # the source pixel index of each entry
+    cols = numpy.arange(n.sum()) - numpy.repeat(numpy.cumsum(n)-n, n) + numpy.repeat(lo, n)
+    weights = numpy.exp(-0.5*((source[cols]-target[rows])/sigma)**2)
+    weights /= numpy.bincount(rows, weights=weights, minlength=len(target))[rows]
+    return rows, cols, weights
+
+def _defaultFWHM(target):
+    return float(numpy.median(numpy.diff(target)))
+
+def _key(source, target, method, fwhm):
+    h = hashlib.sha256()
+    for w in [source, target]:
+        h.update(numpy.ascontiguousarray(w, dtype=numpy.float64).tobytes())
+    h.update(('%s %r %d'%(method, fwhm, CACHE_VERSION)).encode())
+    return h.hexdigest()
+
+def _cacheName(key):
+    d = cache_dir()
+    if d is None:
+        return None
+    return d.joinpath('resample_%s.npz'%key)
+
+def _load(name):
+    with numpy.load(name) as cached:
+        return sparse.csr_matrix((cached['data'],cached['indices'],cached['indptr']), shape=tuple(cached['shape']))
+
+def _store(name, matrix):
+    tmp = name.with_name('%s.%d.tmp.npz'%(name.stem,os.getpid()))
+    numpy.savez(tmp, data=matrix.data, indices=matrix.indices, indptr=matrix.indptr, shape=matrix.shape)
+    os.replace(tmp, name)
+
+# the functions computing the entries of the resampling matrix of each method
+_builders = {'linear' : _linear,
+             'gaussian' : _gaussian}
+
+def _cached(key, build):
+    """the matrix for key from memory or the cache directory, build it if it is not cached"""
+    if key in _matrices:
+        return _matrices[key]
+    name = _cacheName(key)
+    matrix = None
+    if name is not None and name.exists():
+        try:
+            matrix = _load(name)
+        except Exception as e:
+            logging.getLogger("piccolo.resample").warning('ignoring cache file %s: %s'%(name,e))
+    if matrix is None:
+        matrix = build()
+        if name is not None:
+            try:
+                _store(name, matrix)
+            except OSError as e:
+                logging.getLogger("piccolo.resample").warning('cannot write cache file %s: %s'%(name,e))
+    _matrices[key] = matrix
+    return matrix
+
+def resampling_matrix(source, target, method='linear', fwhm=None, cache=True):
+    """the sparse matrix mapping spectra from source onto target wavelengths
+
+    Target wavelengths outside the source range get an empty row.
+
+    Parameters
+    ----------
+    source: the increasing wavelengths of the spectra
+    target: the wavelengths to resample to
+    method: linear - linear interpolation
+            gaussian - convolution with a normalised Gaussian
+    fwhm: the full width at half maximum of the Gaussian in nm, default: the
+          spacing of the target wavelengths
+    cache: when True, keep the matrix in a binary file in the cache directory
+           keyed by the hash of the wavelengths and method
+
+    Returns
+    -------
+    a scipy.sparse CSR matrix of shape (len(target), len(source))
+    """
+    if method not in _builders:
+        raise ValueError('unknown resampling method %s'%method)
+    source = numpy.asarray(source, dtype=float)
+    target = numpy.asarray(target, dtype=float)
+    if method == 'gaussian' and fwhm is None:
+        fwhm = _defaultFWHM(target)
+
+    def build():
+        rows, cols, weights = _builders[method](source, target, fwhm)
+        return sparse.csr_matrix((weights,(rows,cols)), shape=(len(target),len(source)))
+
+    if not cache:
+        return build()
+    return _cached(_key(source, target, method, fwhm), build)
+
+def resample(spectra, matrix):
+    """resample a block of spectra
+
+    Parameters
+    ----------
+    spectra: 2D array of spectra, one spectrum per row
+    matrix: the resampling matrix
+
+    Returns
+    -------
+    the resampled spectra, NaN outside the source wavelength range
+    """
+    result = numpy.asarray(numpy.asarray(spectra, dtype=float) @ matrix.T)
+    result[:, numpy.diff(matrix.indptr) == 0] = numpy.nan
+    return result
+
+def resample_spectra(ds, wavelengths, output, method='linear', fwhm=None, chunkSize=1000):
+    """resample all spectral variables of a dataset onto common wavelengths
+
+    The dataset is processed in chunks, each chunk is resampled with a
+    single sparse matrix product and appended to the output file.
+
+    Parameters
+    ----------
+    ds: xarray dataset produced by piccolo3-read, piccolo3-apply-calibration
+        or piccolo3-reflectance
+    wavelengths: the common wavelengths
+    output: the name of the output netCDF file
+    method: the resampling method, see resampling_matrix
+    fwhm: the width of the Gaussian
+    chunkSize: the number of spectra processed at a time
+    """
+    wavelengths = numpy.asarray(wavelengths, dtype=float)
+    if method == 'gaussian' and fwhm is None:
+        fwhm = _defaultFWHM(wavelengths)
+    matrix = resampling_matrix(ds.wavelengths.values, wavelengths, method=method, fwhm=fwhm)
+    names = [n for n in ds.data_vars if 'wavelengths' in ds[n].dims]
+    source = ds.wavelengths.attrs.get('wavelength_source')
+
+    writer = ChunkedNetCDFWriter(output)
+    for chunk in iter_chunks(ds, chunkSize=chunkSize):
+        result = chunk.drop_dims('wavelengths')
+        result = result.assign_coords(wavelengths=('wavelengths', wavelengths))
+        for n in names:
+            v = chunk[n].transpose('measurement','wavelengths')
+            result[n] = (v.dims, resample(v.values, matrix), v.attrs)
+        if source is not None:
+            result.wavelengths.attrs['wavelength_source'] = source
+        result.wavelengths.attrs['resampling_method'] = method
+        if method == 'gaussian':
+            result.wavelengths.attrs['resampling_fwhm'] = fwhm
+        writer.write(result)
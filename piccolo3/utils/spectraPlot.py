@@ -0,0 +1,91 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ['DECIMATE_METHODS','plot_spectra']
+
+import numpy
+from matplotlib.collections import LineCollection
+from matplotlib.colors import LinearSegmentedColormap, LogNorm, to_rgba
+
+DECIMATE_METHODS = ['envelope','density']
+
+def _edges(values, bins):
+    """equally spaced bin edges covering the values, widened if all values are equal"""
+    lo = values.min()
+    hi = values.max()
+    if lo == hi:
+        lo = lo-0.5
+        hi = hi+0.5
+    return numpy.linspace(lo, hi, bins+1)
+
+def plot_spectra(ax, wavelengths, spectra, color, linestyle='-', maxLines=1000, decimate='envelope', intensityBins=256):
+    """plot a set of spectra using a single artist
+
+    Up to maxLines spectra are drawn as a LineCollection. Larger sets are
+    decimated, either to the envelope of the spectra or to an image of
+    the density of the spectra in the wavelength/intensity plane.
+
+    Parameters
+    ----------
+    ax: the matplotlib axes to plot into
+    wavelengths: the wavelengths, either 1D if shared by all spectra or a 2D array
+    spectra: 2D array of spectra, one spectrum per row
+    color: the colour of the spectra
+    linestyle: the line style of the spectra and of the envelope outline
+    maxLines: the maximum number of spectra plotted individually
+    decimate: envelope - fill between the minimum and maximum of each pixel
+              density - 2D histogram of the intensities against wavelength
+    intensityBins: the number of intensity bins of the density image
+
+    Returns
+    -------
+    the matplotlib artist, None if the spectra contain no finite intensities
+    """
+    spectra = numpy.atleast_2d(numpy.asarray(spectra, dtype=float))
+    wavelengths = numpy.broadcast_to(numpy.asarray(wavelengths, dtype=float), spectra.shape)
+    if decimate is not None and decimate not in DECIMATE_METHODS:
+        raise ValueError('unknown decimate method %s'%decimate)
+
+    if decimate is None or len(spectra) <= maxLines:
+        artist = LineCollection(numpy.stack([wavelengths, spectra], axis=-1), colors=color, linestyles=linestyle)
+        ax.add_collection(artist)
+        ax.autoscale_view()
+        return artist
+
+    if decimate == 'envelope':
+        # all spectra of an instrument have the same number of pixels, the
+        # wavelengths of a pixel only differ by small calibration changes
+        with numpy.errstate(invalid='ignore'):
+            lo = numpy.nanmin(spectra, axis=0)
+            hi = numpy.nanmax(spectra, axis=0)
+        return ax.fill_between(numpy.mean(wavelengths, axis=0), lo, hi,
+                               facecolor=to_rgba(color, 0.4), edgecolor=color, linestyle=linestyle)
+
+    valid = numpy.isfinite(spectra)
+    if not valid.any():
+        return None
+    w = wavelengths[valid]
+    p = spectra[valid]
+    wEdges = _edges(w, spectra.shape[1])
+    pEdges = _edges(p, intensityBins)
+    counts,_,_ = numpy.histogram2d(w, p, bins=[wEdges, pEdges])
+    cmap = LinearSegmentedColormap.from_list('density', [to_rgba(color, 0.1), to_rgba(color, 1.)])
+    artist = ax.imshow(numpy.ma.masked_equal(counts.T, 0), cmap=cmap, norm=LogNorm(vmin=1, vmax=max(counts.max(), 1)),
+                       extent=(wEdges[0], wEdges[-1], pEdges[0], pEdges[-1]), origin='lower', aspect='auto',
+                       interpolation='nearest')
+    ax.autoscale_view()
+    return artist
@@ -0,0 +1,251 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ['SpectraStatistics','spectra_statistics']
+
+import numpy
+
+class SpectraStatistics(object):
+    """streaming per wavelength statistics of a set of spectra
+
+    Blocks of spectra are added one at a time with update. Mean, standard
+    deviation and count are computed exactly in a single pass. Median and
+    trimmed mean are estimated from a reservoir sample of spectra of bounded
+    size, they are exact as long as fewer spectra than the reservoir size
+    have been added.
+    """
+
+    def __init__(self, minValue=None, robust=False, reservoirSize=1000, seed=None):
+        """
+        Parameters
+        ----------
+        minValue: only use values larger than minValue, default use all finite values
+        robust: keep a reservoir sample for the robust statistics
+        reservoirSize: maximum number of spectra kept in the reservoir
+        seed: seed of the random number generator used for sampling
+        """
+
+        self._minValue = minValue
+
+        self._count = None
+        self._mean = None
+        self._m2 = None
+
+        self._numSpectra = 0
+        self._robust = robust
+        self._reservoirSize = reservoirSize
+        self._reservoir = None
+        self._rng = numpy.random.default_rng(seed)
+
+    @property
+    def numSpectra(self):
+        """the number of spectra added"""
+        return self._numSpectra
+    @property
+    def count(self):
+        """the number of valid values for each wavelength"""
+        return self._count
+    @property
+    def mean(self):
+        """the mean for each wavelength"""
+        if self._count is None:
+            return None
+        with numpy.errstate(invalid='ignore'):
+            return numpy.where(self._count>0, self._mean, numpy.nan)
+    @property
+    def m2(self):
+        """the sum of squared deviations from the mean for each wavelength"""
+        return self._m2
+    @property
+    def variance(self):
+        """the sample variance for each wavelength"""
+        if self._count is None:
+            return None
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            return numpy.where(self._count>1, self._m2/(self._count-1), numpy.nan)
+    @property
+    def std(self):
+        """the sample standard deviation for each wavelength"""
+        if self._count is None:
+            return None
+        return numpy.sqrt(self.variance)
+    @property
+    def exact(self):
+        """True if the robust statistics are computed from all spectra"""
+        return self._numSpectra <= self._reservoirSize
+    @property
+    def median(self):
+        """the (approximate) median for each wavelength"""
+        r = self._getReservoir()
+        with numpy.errstate(invalid='ignore'):
+            return numpy.nanmedian(r, axis=0)
+
+    @classmethod
+    def fromMoments(cls, count, mean, m2, numSpectra=None, **keywords):
+        """restore the running statistics, eg from a file, so that further spectra can be added
+
+        Parameters
+        ----------
+        count: the number of valid values for each wavelength
+        mean: the mean for each wavelength
+        m2: the sum of squared deviations from the mean for each wavelength
+        numSpectra: the number of spectra added, default: the maximum count
+        keywords: passed on to the constructor, robust statistics are not
+                  supported as the reservoir cannot be restored
+        """
+        if keywords.get('robust', False):
+            raise ValueError('robust statistics cannot be restored from moments')
+        stats = cls(**keywords)
+        stats._count = numpy.array(count, dtype=numpy.int64)
+        stats._mean = numpy.where(stats._count>0, numpy.asarray(mean, dtype=float), 0.)
+        stats._m2 = numpy.where(stats._count>0, numpy.asarray(m2, dtype=float), 0.)
+        if numSpectra is None:
+            numSpectra = int(stats._count.max(initial=0))
+        stats._numSpectra = numSpectra
+        return stats
+
+    def percentile(self, q):
+        """the (approximate) percentiles for each wavelength
+
+        Parameters
+        ----------
+        q: percentile or sequence of percentiles between 0 and 100
+
+        Returns
+        -------
+        array of percentiles, indexed by percentile and wavelength if q is a sequence
+        """
+        # like numpy.nanpercentile with linear interpolation but vectorised
+        # over wavelengths, NaNs are sorted to the end
+        r = numpy.sort(self._getReservoir(), axis=0)
+        n = numpy.sum(numpy.isfinite(r), axis=0)
+        pos = numpy.atleast_1d(numpy.asarray(q, dtype=float))[:,None]/100.*numpy.maximum(n-1,0)
+        lo = numpy.floor(pos).astype(int)
+        hi = numpy.minimum(lo+1, numpy.maximum(n-1,0))
+        f = pos-lo
+        p = numpy.take_along_axis(r, lo, axis=0)*(1-f) + numpy.take_along_axis(r, hi, axis=0)*f
+        p[:, n==0] = numpy.nan
+        return p if numpy.ndim(q) > 0 else p[0]
+
+    def trimmedMean(self, proportion=0.1):
+        """the (approximate) trimmed mean for each wavelength
+
+        Parameters
+        ----------
+        proportion: the fraction cut off at each end of the distribution
+        """
+        r = numpy.sort(self._getReservoir(), axis=0)
+        # NaNs are sorted to the end
+        n = numpy.sum(numpy.isfinite(r), axis=0)
+        cut = (proportion*n).astype(int)
+        rank = numpy.arange(r.shape[0])[:,None]
+        keep = (rank >= cut) & (rank < n-cut)
+        with numpy.errstate(invalid='ignore'):
+            return numpy.sum(numpy.where(keep, r, 0.), axis=0)/numpy.sum(keep, axis=0)
+
+    def _getReservoir(self):
+        if not self._robust:
+            raise RuntimeError('robust statistics were not requested')
+        if self._reservoir is None:
+            raise RuntimeError('no spectra added yet')
+        return self._reservoir[:min(self._numSpectra, self._reservoirSize)]
+
+    def update(self, spectra):
+        """add a block of spectra
+
+        Parameters
+        ----------
+        spectra: a 2D array of spectra, one spectrum per row
+        """
+        spectra = numpy.asarray(spectra, dtype=float)
+        if spectra.ndim == 1:
+            spectra = spectra[None,:]
+        if spectra.shape[0] == 0:
+            return
+        if self._count is None:
+            nw = spectra.shape[1]
+            self._count = numpy.zeros(nw, dtype=numpy.int64)
+            self._mean = numpy.zeros(nw)
+            self._m2 = numpy.zeros(nw)
+        elif spectra.shape[1] != len(self._count):
+            raise ValueError('expected {} wavelengths, got {}'.format(len(self._count), spectra.shape[1]))
+
+        valid = numpy.isfinite(spectra)
+        if self._minValue is not None:
+            with numpy.errstate(invalid='ignore'):
+                valid &= spectra > self._minValue
+
+        # statistics of the block
+        n_b = numpy.sum(valid, axis=0)
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            mean_b = numpy.where(n_b>0, numpy.sum(numpy.where(valid, spectra, 0.), axis=0)/n_b, 0.)
+        m2_b = numpy.sum(numpy.where(valid, spectra-mean_b, 0.)**2, axis=0)
+
+        # and combine with the running statistics
+        n_a = self._count
+        n = n_a + n_b
+        delta = mean_b - self._mean
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            f = numpy.where(n>0, n_b/n, 0.)
+        self._mean = self._mean + delta*f
+        self._m2 = self._m2 + m2_b + delta**2*n_a*f
+        self._count = n
+
+        if self._robust:
+            self._sample(numpy.where(valid, spectra, numpy.nan))
+        self._numSpectra += spectra.shape[0]
+
+    def _sample(self, spectra):
+        """reservoir sampling of spectra"""
+        # the reservoir grows as needed up to its maximum size so that
+        # statistics of few spectra do not allocate the whole reservoir
+        n = min(self._reservoirSize, self._numSpectra+spectra.shape[0])
+        if self._reservoir is None or len(self._reservoir) < n:
+            size = n if self._reservoir is None else min(self._reservoirSize, max(n, 2*len(self._reservoir)))
+            reservoir = numpy.empty((size, spectra.shape[1]))
+            if self._reservoir is not None:
+                reservoir[:self._numSpectra] = self._reservoir[:self._numSpectra]
+            self._reservoir = reservoir
+        t = self._numSpectra + numpy.arange(spectra.shape[0])
+        # fill the reservoir
+        fill = t < self._reservoirSize
+        self._reservoir[t[fill]] = spectra[fill]
+        # and replace randomly selected spectra once it is full
+        j = self._rng.integers(0, t[~fill]+1)
+        replace = j < self._reservoirSize
+        # with repeated indices the last assignment wins, as it would when
+        # processing the spectra one by one
+        self._reservoir[j[replace]] = spectra[~fill][replace]
+
+def spectra_statistics(spectra, chunkSize=1000, **keywords):
+    """compute the per wavelength statistics of spectra in chunks
+
+    Parameters
+    ----------
+    spectra: array of spectra indexed by measurement and wavelength, when an
+             xarray DataArray backed by a file only a chunk is loaded at a time
+    chunkSize: the number of spectra processed at a time
+    keywords: passed on to SpectraStatistics
+
+    Returns
+    -------
+    a SpectraStatistics object
+    """
+    stats = SpectraStatistics(**keywords)
+    for i in range(0, spectra.shape[0], chunkSize):
+        stats.update(numpy.asarray(spectra[i:i+chunkSize]))
+    return stats
@@ -0,0 +1,164 @@
+# Copyright 2018- The Piccolo Team
+#
+# This file is part of piccolo3-utils.
+#
+# piccolo3-utils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# piccolo3-utils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with piccolo3-utils.  If not, see <http://www.gnu.org/licenses/>.
+
+__all__ = ['PolynomialFit','fit_polynomial']
+
+import numpy
+from numpy.polynomial import Polynomial
+
+class PolynomialFit(object):
+    """result of fitting polynomials of increasing order"""
+
+    def __init__(self, orders, coeffs, rss, cv, order, mask, iterations):
+        self._orders = orders
+        self._coeffs = coeffs
+        self._rss = rss
+        self._cv = cv
+        self._order = order
+        self._mask = mask
+        self._iterations = iterations
+
+    @property
+    def orders(self):
+        """the polynomial orders fitted"""
+        return self._orders
+    @property
+    def order(self):
+        """the selected order"""
+        return self._order
+    @property
+    def coeffs(self):
+        """the coefficients of the selected order, highest power first"""
+        return self._coeffs[self.order]
+    def coeffsOfOrder(self, order):
+        """the coefficients of a given order, highest power first"""
+        return self._coeffs[order]
+    @property
+    def rss(self):
+        """the (weighted) residual sum of squares of each order"""
+        return self._rss
+    @property
+    def cv(self):
+        """the leave-one-out cross validation mean square error of each order"""
+        return self._cv
+    @property
+    def mask(self):
+        """boolean array of the points used in the final fit"""
+        return self._mask
+    @property
+    def iterations(self):
+        """the number of sigma clipping iterations"""
+        return self._iterations
+
+    def __call__(self, x):
+        return numpy.polyval(self.coeffs, x)
+
+def _fitOrders(x, y, w, maxOrder):
+    """fit all orders up to maxOrder using a single QR factorisation
+
+    The columns of the Vandermonde matrix are nested, so the least squares
+    solution of order k only depends on the first k+1 columns of Q and
+    the leading (k+1)x(k+1) block of R.
+    """
+    n1 = maxOrder+1
+    # scale to [-1,1] to keep the Vandermonde matrix well conditioned
+    xmin = x.min()
+    xmax = x.max()
+    if xmax == xmin:
+        xmax = xmin+1.
+    t = (2*x-(xmin+xmax))/(xmax-xmin)
+    A = numpy.vander(t, n1, increasing=True)*w[:,None]
+    b = y*w
+
+    Q,R = numpy.linalg.qr(A)
+    qb = Q.T @ b
+    # fitted values and the diagonal of the hat matrix of every order
+    fitted = numpy.cumsum(Q*qb, axis=1)
+    h = numpy.cumsum(Q**2, axis=1)
+    residuals = b[:,None]-fitted
+    rss = numpy.sum(residuals**2, axis=0)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        loo = residuals/(1.-h)
+    cv = numpy.where(numpy.all(h < 1.-1e-10, axis=0), numpy.mean(loo**2, axis=0), numpy.inf)
+
+    # solve the triangular systems of all orders in one batched call; the
+    # unused part of each system is replaced by the identity
+    k = numpy.arange(n1)
+    used = k[None,:] <= k[:,None]
+    M = numpy.where(used[:,:,None] & used[:,None,:], R[None,:,:], numpy.eye(n1)[None,:,:])
+    rhs = numpy.where(used, qb[None,:], 0.)
+    c = numpy.linalg.solve(M, rhs[:,:,None])[:,:,0]
+
+    coeffs = []
+    for order in range(n1):
+        p = Polynomial(c[order,:order+1], domain=[xmin,xmax], window=[-1,1]).convert()
+        coeffs.append(numpy.pad(p.coef, (0, order+1-len(p.coef)))[::-1])
+    return coeffs, rss, cv
+
+def fit_polynomial(x, y, maxOrder=3, order=None, weights=None, sigmaClip=None, maxIter=10):
+    """fit polynomials of order 1 to maxOrder and select the best one
+
+    All orders are solved together. Each order is scored with leave-one-out
+    cross validation, computed in closed form from the diagonal of the hat
+    matrix. Optionally, outliers are removed by iterative sigma clipping.
+
+    Parameters
+    ----------
+    x: the x values
+    y: the y values
+    maxOrder: the maximum order of the polynomial
+    order: use this order instead of selecting the order with the lowest
+           cross validation error
+    weights: weights applied to the residuals as in numpy.polyfit
+    sigmaClip: remove points whose residual exceeds sigmaClip times the RMS residual
+    maxIter: the maximum number of sigma clipping iterations
+
+    Returns
+    -------
+    a PolynomialFit object
+    """
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    if weights is None:
+        weights = numpy.ones(len(x))
+    else:
+        weights = numpy.asarray(weights, dtype=float)
+    if order is not None and order > maxOrder:
+        maxOrder = order
+    if len(x) < maxOrder+1:
+        raise RuntimeError('need at least %d points to fit a polynomial of order %d, got %d'%(maxOrder+1,maxOrder,len(x)))
+
+    mask = numpy.ones(len(x), dtype=bool)
+    iterations = 0
+    while True:
+        coeffs, rss, cv = _fitOrders(x[mask], y[mask], weights[mask], maxOrder)
+        if order is None:
+            best = 1+int(numpy.argmin(cv[1:]))
+        else:
+            best = order
+        if sigmaClip is None or iterations >= maxIter:
+            break
+        residuals = y-numpy.polyval(coeffs[best], x)
+        rms = numpy.sqrt(numpy.mean(residuals[mask]**2))
+        newMask = numpy.abs(residuals) <= sigmaClip*rms
+        if numpy.array_equal(newMask, mask) or newMask.sum() < maxOrder+1:
+            break
+        mask = newMask
+        iterations += 1
+
+    orders = numpy.arange(1, maxOrder+1)
+    return PolynomialFit(orders, dict(zip(range(maxOrder+1), coeffs)), rss[1:], cv[1:], best, mask, iterations)
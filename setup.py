@@ -40,6 +40,7 @@ setup(
                       'scipy>1.2.0',
                       'piccolo3-common',
                       'xarray',
+                      'netCDF4',
                       'matplotlib',
                       'pandas',
                       'sortedcontainers',
@@ -52,9 +53,15 @@ setup(
     'console_scripts': [
       'piccolo3-read = piccolo3.readpicco:main',
       'piccolo3-calibrate = piccolo3.radiometric_cal:main',
+      'piccolo3-apply-calibration = piccolo3.apply_calibration:main',
+      'piccolo3-reflectance = piccolo3.reflectance:main',
+      'piccolo3-resample = piccolo3.resample:main',
+      'piccolo3-aggregate = piccolo3.aggregate:main',
       'piccolo3-wavelengthCalibration = piccolo3.pcalibrate:main',
       'piccolo3-display = piccolo3.disppicco:main',
       'piccolo3-display-dark = piccolo3.dispdark:main',
+      'piccolo3-quicklook = piccolo3.quicklook:main',
+      'piccolo3-dark-trend = piccolo3.dark_trend:main',
       'piccolo3-discard-saturated = piccolo3.discard_saturated:main',
     ],
     'gui_scripts': [